@@ -45,113 +45,927 @@
 # %% [markdown]
 # ##### Módulos Usados
 
+# %% [markdown]
+# As bibliotecas de gráficos (`plotly` e `matplotlib`) são importadas apenas dentro das funções que constroem os gráficos, e os dados só são carregados na primeira consulta. Assim, o menu aparece logo que o programa arranca.
+
 # %%
+import io
 import os
+import sys
+import csv
+import time
+import argparse
+import json
+import hashlib
+import importlib.util
+import unicodedata
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.subplots as sp
-import plotly.graph_objects as go
-from ipywidgets import widgets
-from art import *
 from tabulate import tabulate
 from functools import partial
+from bisect import bisect_left
+from urllib.parse import urlsplit, parse_qs
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+import cProfile
+import pstats
+import tracemalloc
+import traceback
+
+# %% [markdown]
+# ##### Instrumentação das etapas
+#
+# Cada etapa do tratamento dos dados (leitura, divisão, limpeza, escrita, hash, cache e carga), cada construção de gráfico e cada ação escolhida no menu é medida com `medir`: tempo, número de linhas processadas e variação da memória (memória residente do processo ou, com o perfil ativo, memória alocada pelo Python). Os totais por etapa ficam em `medicoes` e os contadores em `contadores`; `imprimir_medicoes` apresenta o resumo.
+#
+# Com `--registo FICHEIRO` (ou a variável de ambiente `PROJETO_REGISTO`) cada medição é também escrita numa linha JSON, e com `--perfil FICHEIRO` (ou `PROJETO_PERFIL`) a execução corre sob o `cProfile` e o `tracemalloc`, com as funções e as linhas mais pesadas apresentadas no fim. As ações do menu incluem o tempo de espera pelas respostas do utilizador; as medições dos gráficos e das consultas não.
+
+# %%
+# Ficheiro JSON lines onde é escrita cada medição (None para não escrever) e ficheiro do perfil cProfile (None sem perfil)
+REGISTO_MEDICOES = os.environ.get('PROJETO_REGISTO')
+PERFIL = os.environ.get('PROJETO_PERFIL')
+
+# Número de funções e de linhas apresentadas no fim do perfil
+LINHAS_PERFIL = 20
+
+# Totais por etapa (chamadas, tempo, linhas e memória), contadores e etapas em curso (para registar a etapa de origem)
+medicoes = {}
+contadores = {}
+etapas_abertas = []
+
+
+def memoria_atual():
+    # Memória alocada pelo Python (com o tracemalloc ativo) ou memória residente do processo (apenas em Linux)
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def registar(evento):
+    # Acrescentar um evento ao registo JSON lines (os valores numpy são convertidos para tipos do Python)
+    if REGISTO_MEDICOES:
+        with open(REGISTO_MEDICOES, 'a') as f:
+            f.write(json.dumps(evento, ensure_ascii=False, default=lambda v: v.item() if hasattr(v, 'item') else str(v)) + '\n')
+
+
+@contextmanager
+def medir(nome, **atributos):
+    # Medir uma etapa; o bloco pode acrescentar atributos ao dicionário devolvido, em particular o número de 'linhas'
+    etapa = dict(atributos)
+    memoria = memoria_atual()
+    etapas_abertas.append(nome)
+    inicio = time.perf_counter()
+    try:
+        yield etapa
+    finally:
+        duracao = time.perf_counter() - inicio
+        etapas_abertas.pop()
+        fim = memoria_atual()
+        delta = fim - memoria if memoria is not None and fim is not None else None
+
+        total = medicoes.setdefault(nome, {'chamadas': 0, 'duracao_s': 0.0, 'max_s': 0.0, 'linhas': 0, 'memoria_bytes': 0})
+        total['chamadas'] += 1
+        total['duracao_s'] += duracao
+        total['max_s'] = max(total['max_s'], duracao)
+        total['linhas'] += int(etapa.get('linhas', 0))
+        total['memoria_bytes'] += delta or 0
+        registar({'tipo': 'etapa', 'nome': nome, 'origem': etapas_abertas[-1] if etapas_abertas else None,
+                  'inicio': time.time() - duracao, 'duracao_s': duracao, 'memoria_bytes': delta, **etapa})
+
+
+def iterar_medido(nome, iteravel):
+    # Medir separadamente a produção de cada elemento de um iterável (ex.: a leitura de cada bloco do ficheiro)
+    iterador = iter(iteravel)
+    fim = object()
+    while True:
+        with medir(nome) as etapa:
+            elemento = next(iterador, fim)
+            if elemento is not fim:
+                etapa['linhas'] = len(elemento)
+        if elemento is fim:
+            return
+        yield elemento
+
+
+def contar(nome, n=1):
+    contadores[nome] = contadores.get(nome, 0) + int(n)
+
+
+def reiniciar_medicoes():
+    medicoes.clear()
+    contadores.clear()
+
+
+def tabela_medicoes():
+    # Resumo das etapas medidas, da mais demorada para a menos demorada
+    linhas = []
+    for nome, total in sorted(medicoes.items(), key=lambda item: -item[1]['duracao_s']):
+        linhas.append({
+            'Etapa': nome,
+            'Chamadas': total['chamadas'],
+            'Total (s)': round(total['duracao_s'], 4),
+            'Média (ms)': round(total['duracao_s'] / total['chamadas'] * 1000, 3),
+            'Máx. (ms)': round(total['max_s'] * 1000, 3),
+            'Linhas': total['linhas'],
+            'Linhas/s': round(total['linhas'] / total['duracao_s']) if total['linhas'] and total['duracao_s'] else '',
+            'Memória (MB)': round(total['memoria_bytes'] / 2 ** 20, 2),
+        })
+    return pd.DataFrame(linhas)
+
+
+def imprimir_medicoes():
+    if medicoes:
+        print(tabulate(tabela_medicoes(), headers='keys', tablefmt='fancy_grid', showindex=False))
+    if contadores:
+        print(tabulate(sorted(contadores.items()), headers=['Contador', 'Valor'], tablefmt='fancy_grid'))
+
+
+@contextmanager
+def perfil(destino):
+    # Executar o bloco sob o cProfile (tempo por função, guardado em 'destino') e o tracemalloc (memória por linha)
+    tracemalloc.start()
+    perfilador = cProfile.Profile()
+    perfilador.enable()
+    try:
+        yield perfilador
+    finally:
+        perfilador.disable()
+        fotografia = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        perfilador.dump_stats(destino)
+        pstats.Stats(perfilador).sort_stats('cumulative').print_stats(LINHAS_PERFIL)
+        print('Linhas com mais memória alocada:')
+        for estatistica in fotografia.statistics('lineno')[:LINHAS_PERFIL]:
+            print(f'  {estatistica}')
 
 # %% [markdown]
 # ##### 2.2.1. Upload dos dados em bruto
 
+# %% [markdown]
+# O ficheiro em bruto não é carregado de uma só vez: é lido por blocos de `CHUNK_SIZE` linhas e cada bloco é limpo e escrito logo de seguida nos ficheiros de saída. Desta forma a memória usada fica limitada pelo tamanho do bloco e não pelo tamanho do ficheiro.
+
 # %%
-#Carregar o conjunto de dados principal a partir do arquivo CSV especificado ('Mental_health_Depression_disorder_Data.csv')
-dataset = pd.read_csv('data/raw_data/Mental_health_Depression_disorder_Data.csv')
+# Caminhos dos ficheiros de dados em bruto e da pasta onde são guardados os dados limpos
+RAW_PATH = 'data/raw_data/Mental_health_Depression_disorder_Data.csv'
+ISO_PATH = 'data/raw_data/iso_countries.csv'
+CLEAN_DIR = 'data/clean_data'
+
+# Número de linhas do ficheiro em bruto lidas de cada vez
+CHUNK_SIZE = 20000
 
-# Carregar outro conjunto de dados contendo códigos de país ISO a partir do arquivo CSV especificado ('iso_countries.csv')
-iso_countries = pd.read_csv('data/raw_data/iso_countries.csv')
+# Conjunto de dados contendo códigos de país ISO, carregado apenas quando é necessário
+df_iso = None
+
+
+def obter_iso():
+    global df_iso
+    if df_iso is None:
+        # Carregar o conjunto de dados contendo códigos de país ISO a partir do arquivo CSV especificado ('iso_countries.csv')
+        df_iso = pd.read_csv(ISO_PATH)
+    return df_iso
 
 # %% [markdown]
-# ##### 2.2.2. Criação dos dataframes
+# ##### 2.2.2. Leitura por blocos e identificação das sub-tabelas
 
 # %%
-# Criar um novo DataFrame do pandas chamado 'df_geral' e preenchê-lo com os dados do conjunto de dados principal
-df_geral = pd.DataFrame(dataset)
+def ler_blocos(caminho, chunksize=CHUNK_SIZE):
+    # Número da sub-tabela da última linha processada (a primeira sub-tabela usa o cabeçalho do ficheiro)
+    i = 0
+
+    # Última linha do bloco anterior, que só é processada quando chega o bloco seguinte
+    pendente = None
+
+    # Ler o ficheiro por blocos, mantendo todos os valores como texto para que sejam escritos tal como estão no ficheiro
+    for bloco in iterar_medido('leitura', pd.read_csv(caminho, dtype=str, chunksize=chunksize)):
+        with medir('divisao', linhas=len(bloco)):
+            if pendente is not None:
+                bloco = pd.concat([pendente, bloco], ignore_index=True)
+
+            # A última linha do ficheiro nunca era incluída nas sub-tabelas, por isso guarda-se sempre a última linha de cada
+            # bloco e só é processada se ainda houver linhas depois dela
+            pendente = bloco.iloc[-1:]
+            bloco = bloco.iloc[:-1]
+
+            # Identificar as linhas de cabeçalho das sub-tabelas (coluna 'Year' igual à string 'Year')
+            cabecalhos = (bloco['Year'] == 'Year').to_numpy()
+
+            # Atribuir a cada linha o número da sua sub-tabela: cada linha de cabeçalho inicia uma nova sub-tabela
+            rotulos = i + np.cumsum(cabecalhos)
+            if len(rotulos):
+                i = rotulos[-1]
+
+        yield bloco, rotulos, cabecalhos
 
-# Criar um novo DataFrame do pandas chamado 'df_iso' e preenchê-lo com os dados do conjunto de dados de códigos de país ISO
-df_iso = pd.DataFrame(iso_countries)
 
 # %% [markdown]
-# ##### 2.2.3. Identificação das sub-tabelas
+# ##### 2.2.3. Definição das colunas de cada sub-tabela
 
 # %%
-# Criar uma visualização de subconjunto (subtable_view) do DataFrame df_geral, selecionando apenas as linhas em que a coluna 'Year' é igual à string 'Year' para identificar os cabeçalhos de coluna
-subtable_view = df_geral[df_geral['Year'] == 'Year']
+def esquema_subtabela(colunas_ficheiro, cabecalho=None):
+    # A primeira sub-tabela usa o cabeçalho do próprio ficheiro
+    if cabecalho is None:
+        return {'colunas': list(colunas_ficheiro), 'nomes': list(colunas_ficheiro)}
 
-# Exibir as primeiras linhas da visualização de subconjunto usando o método head(), que por padrão mostra as primeiras 5 linhas
-subtable_view.head()
+    # Nas restantes, as colunas vazias na linha de cabeçalho não pertencem à sub-tabela
+    colunas = cabecalho.index[cabecalho.notna()].tolist()
+    return {'colunas': colunas, 'nomes': cabecalho[colunas].tolist()}
 
 
 # %% [markdown]
-# ##### 2.2.4. Identificação dos índices para separação das tabelas
+# ##### 2.2.4. Limpeza vetorizada de cada bloco
+
+# %% [markdown]
+# A limpeza é feita sobre o bloco inteiro de uma só vez, independentemente do número de sub-tabelas que contém: o preenchimento da coluna `Code`, a remoção de linhas com valores nulos (apenas nas colunas de cada sub-tabela), a remoção das linhas de cabeçalho, a correspondência com os códigos ISO e a separação entre países e agregados são operações vetorizadas. Só a escrita final é feita por sub-tabela.
 
 # %%
-# Criar uma lista (index_lst) contendo os valores da coluna 'index' da visualização de subconjunto (subtable_view)
-index_lst = subtable_view['index'].tolist()
+def limpar_bloco(bloco, rotulos, cabecalhos, esquemas, iso_regioes, iso_codigos):
+    colunas = bloco.columns
 
-# Inserir o valor 0 no início da lista
-index_lst.insert(0, 0)
+    # Matriz (sub-tabela x coluna) que indica as colunas pertencentes a cada sub-tabela
+    obrigatorias = np.zeros((max(esquemas) + 1, len(colunas)), dtype=bool)
+    for i, esquema in esquemas.items():
+        obrigatorias[i] = colunas.isin(esquema['colunas'])
 
-# Adicionar o último valor da coluna 'index' do DataFrame original (df_geral) ao final da lista
-index_lst.append(df_geral['index'].iloc[-1])
+    # Calcular os valores nulos apenas das colunas usadas pelas sub-tabelas presentes no bloco
+    usadas = np.flatnonzero(obrigatorias[np.unique(rotulos)].any(axis=0))
+    nulos = np.zeros((len(bloco), len(colunas)), dtype=bool)
+    nulos[:, usadas] = bloco.iloc[:, usadas].isna().to_numpy()
 
-# Imprimir a lista resultante
-print(index_lst)
+    # Substituir 'NaN' na coluna 'Code' pelo valor correspondente na coluna 'Entity'
+    c_code, c_entity = colunas.get_loc('Code'), colunas.get_loc('Entity')
+    codigos = bloco['Code'].to_numpy(copy=True)
+    codigos[nulos[:, c_code]] = bloco['Entity'].to_numpy()[nulos[:, c_code]]
+    nulos[:, c_code] = nulos[:, c_entity]
+
+    # Manter as linhas sem valores nulos nas colunas da sua sub-tabela, excluindo as linhas de cabeçalho
+    validas = np.flatnonzero(~(nulos & obrigatorias[rotulos]).any(axis=1) & ~cabecalhos)
+    if not len(validas):
+        return {}
+    rotulos = rotulos[validas]
+    codigos = codigos[validas]
+
+    # Correspondência com os códigos ISO feita uma única vez por cada código distinto do bloco
+    posicoes, distintos = pd.factorize(codigos)
+    continentes = iso_regioes.reindex(distintos).to_numpy()[posicoes]
+    iso = pd.Index(distintos).isin(iso_codigos)[posicoes]
+
+    # Separar as linhas pelas sub-tabelas (as linhas de cada sub-tabela são contíguas) e por países/agregados
+    resultado = {}
+    limites = np.flatnonzero(np.diff(rotulos)) + 1
+    for inicio, fim in zip(np.r_[0, limites], np.r_[limites, len(rotulos)]):
+        i = rotulos[inicio]
+        partes = []
+        for mascara in (iso[inicio:fim], ~iso[inicio:fim]):
+            linhas = inicio + np.flatnonzero(mascara)
+
+            # Construir cada tabela de saída coluna a coluna, já com os nomes das colunas da sub-tabela
+            dados = {}
+            for coluna, nome in zip(esquemas[i]['colunas'], esquemas[i]['nomes']):
+                dados[nome] = codigos[linhas] if coluna == 'Code' else bloco[coluna].to_numpy()[validas[linhas]]
+            dados['Continent'] = continentes[linhas]
+            partes.append(pd.DataFrame(dados))
+        resultado[i] = tuple(partes)
+
+    return resultado
 
 
 # %% [markdown]
 # ##### 2.2.5. Operações de limpeza do dataframe principal, criação de novos dataframes a partir das sub-tabelas e armazenamento dos dataframes limpos em ficheiros CSV
 
 # %%
-# Criar um dicionário vazio para armazenar os DataFrames resultantes
-dfs = {}
+def dividir_subtabelas(caminho=RAW_PATH, destino=CLEAN_DIR, chunksize=CHUNK_SIZE, subtabelas=None, validacao=None):
+    # Os CSV são escritos em ficheiros temporários (nome da tabela → caminho), que só substituem os anteriores se toda
+    # a limpeza (e a validação) terminar; um erro a meio não deixa os CSV limpos escritos pela metade
+    temporarios = {}
+    try:
+        n = limpar_ficheiro(caminho, destino, chunksize, subtabelas, validacao, temporarios)
+
+        # Verificações entre as sub-tabelas, no fim da passagem pelo ficheiro
+        if validacao is not None:
+            with medir('validacao'):
+                concluir_validacao(validacao)
+    except BaseException:
+        for temporario in temporarios.values():
+            os.remove(temporario)
+        raise
+
+    for nome, temporario in temporarios.items():
+        os.replace(temporario, f'{destino}/{nome}.csv')
+    return n
+
+
+def limpar_ficheiro(caminho, destino, chunksize, subtabelas, validacao, temporarios):
+    # Ler, limpar, validar e escrever os blocos do ficheiro em bruto nos ficheiros temporários
+
+    # Construir uma única vez as tabelas de correspondência com os códigos ISO
+    df_iso = obter_iso()
+    iso_regioes = df_iso.set_index('alpha-3')['region']
+    iso_codigos = set(df_iso['alpha-3'].str.upper())
+
+    # Dicionário com as colunas de cada sub-tabela, preenchido quando a sub-tabela aparece pela primeira vez
+    esquemas = {}
+
+    # Número de sub-tabelas encontradas no ficheiro
+    n = 0
+
+    for bloco, rotulos, cabecalhos in ler_blocos(caminho, chunksize):
+        if not len(bloco):
+            continue
+
+        # Definir as colunas das sub-tabelas que começam neste bloco
+        if 0 not in esquemas:
+            esquemas[0] = esquema_subtabela(bloco.columns)
+        for pos in np.flatnonzero(cabecalhos):
+            esquemas[rotulos[pos]] = esquema_subtabela(bloco.columns, bloco.iloc[pos])
+        n = max(n, int(rotulos[-1]) + 1)
+
+        # Ignorar as linhas das sub-tabelas que não precisam de ser regeneradas
+        if subtabelas is not None:
+            manter = np.isin(rotulos, list(subtabelas))
+            bloco, rotulos, cabecalhos = bloco[manter], rotulos[manter], cabecalhos[manter]
+            if not len(bloco):
+                continue
+
+        # Criar os ficheiros CSV de cada sub-tabela apenas com o cabeçalho, na primeira vez que aparece
+        for i in np.unique(rotulos):
+            if f'df_{i}' not in temporarios:
+                colunas = esquemas[i]['nomes'] + ['Continent']
+                for nome in (f'df_{i}', f'sub_df_{i}'):
+                    temporarios[nome] = f'{destino}/{nome}.csv.{os.getpid()}.tmp'
+                    pd.DataFrame(columns=colunas).to_csv(temporarios[nome], index=False)
+
+        # Limpar o bloco e acrescentar as linhas aos ficheiros CSV correspondentes
+        with medir('limpeza', linhas=len(bloco)):
+            limpas = limpar_bloco(bloco, rotulos, cabecalhos, esquemas, iso_regioes, iso_codigos)
+
+        # Validar as linhas limpas (ver 'Validação dos dados durante a limpeza')
+        if validacao is not None:
+            with medir('validacao', linhas=len(bloco)):
+                validar_bloco(validacao, limpas, esquemas)
+        with medir('escrita') as etapa:
+            for i, (df_pais, df_agregado) in limpas.items():
+                df_pais.to_csv(temporarios[f'df_{i}'], mode='a', header=False, index=False)
+                df_agregado.to_csv(temporarios[f'sub_df_{i}'], mode='a', header=False, index=False)
+                contar('linhas_paises', len(df_pais))
+                contar('linhas_agregados', len(df_agregado))
+            etapa['linhas'] = sum(len(df_pais) + len(df_agregado) for df_pais, df_agregado in limpas.values())
+        contar('linhas_descartadas', len(bloco) - etapa['linhas'])
+
+    # Devolver o número de sub-tabelas encontradas
+    return n
 
-# Iterar sobre os elementos da lista de índices
-for i in range(len(index_lst) - 1):
-    # Definir o início e o final do intervalo com base nos valores da lista de índices
-    start = index_lst[i]
-    end = index_lst[i + 1] - 1  # Subtrai 1 para obter o intervalo correto
 
-    # Criar um novo DataFrame (dfs[f'df_{i}']) com base no intervalo definido
-    dfs[f'df_{i}'] = df_geral.iloc[start:end + 1].copy()
+# %% [markdown]
+# ##### Validação dos dados durante a limpeza
 
-    # Fazer reset dos índices e remover as colunas que são compostas apenas por valores nulos (NaN)
-    dfs[f'df_{i}'].reset_index(drop=True, inplace=True)
-    dfs[f'df_{i}'] = dfs[f'df_{i}'].dropna(axis=1, how='all')
-    
-    # Substituir 'NaN' na coluna 'Code' pelo valor correspondente na coluna 'Entity'
-    dfs[f'df_{i}']['Code'].fillna(dfs[f'df_{i}']['Entity'], inplace=True)
+# %% [markdown]
+# A limpeza remove as linhas com valores nulos e identifica as sub-tabelas pelas linhas de cabeçalho, mas não verifica se os dados limpos são coerentes. Por isso, durante a mesma passagem pelo ficheiro (sem leituras adicionais), cada bloco limpo é validado com operações vetorizadas:
+#
+# - os cabeçalhos das sub-tabelas começam por `Entity`, `Code` e `Year`;
+# - os valores são numéricos e estão dentro dos limites de cada tipo de métrica (percentagens em [0, 100], taxas por 100 000 habitantes em [0, 100 000], contagens não negativas);
+# - no fim, as sub-tabelas cobrem os mesmos pares (`Entity`, `Year`) de países e a `Population` de df_1 e df_2 (e de sub_df_1 e sub_df_2) coincide, com operações de conjuntos sobre chaves inteiras (entidade × ano).
+#
+# As violações são resumidas num relatório (uma linha por verificação, tabela e coluna, com o número de linhas e alguns exemplos) guardado em `data/cache/validacao.json`, com o hash dos dados validados. As falhas de cobertura são avisos. As restantes são erros: em modo estrito (os comandos da linha de comandos), o primeiro erro interrompe a limpeza com `ErroValidacao`, antes de a cache ser marcada como válida; como os CSV limpos são escritos em ficheiros temporários e só substituem os anteriores no fim, estes ficam intactos. No menu interativo, os erros são apenas indicados (em stderr) e os dados são usados; ainda assim, se a cache assim aceite for depois carregada em modo estrito, o relatório com o mesmo hash faz com que os comandos voltem a falhar com `ErroValidacao`. A validação é medida como a etapa `validacao` (secção de instrumentação).
+#
+# Sem o ficheiro em bruto, os CSV limpos são a fonte dos dados e são eles os validados quando mudam. O comando `validar` apresenta o relatório dos dados atuais: se o último relatório não corresponder a estes dados (por exemplo, porque a cache já existia), os CSV limpos são validados nesse momento.
 
-    # Remover linhas com valores nulos nas colunas
-    dfs[f'df_{i}'] = dfs[f'df_{i}'].dropna(subset=dfs[f'df_{i}'].columns)
+# %%
+# Limites dos valores de cada tipo de métrica (pelo texto do nome da coluna)
+LIMITES_VALORES = [('(%)', 0, 100), ('per 100,000', 0, 100000), ('Population', 0, np.inf), ('(Number)', 0, np.inf)]
 
-    # Renomear as colunas com base na primeira linha, exceto para o primeiro DataFrame
-    if i > 0:
-        col_names = dfs[f'df_{i}'].iloc[0].tolist()
-        dfs[f'df_{i}'].columns = col_names
+# Colunas com que começa o cabeçalho de cada sub-tabela
+COLUNAS_CABECALHO = ['Entity', 'Code', 'Year']
 
-        # Remover a linha que foi usada como nome de colunas
-        dfs[f'df_{i}'] = dfs[f'df_{i}'].iloc[1:].reset_index(drop=True)
-    
-    # Adicionar uma nova coluna 'region' ao DataFrame com base na coluna 'Code' e no DataFrame df_iso
-    dfs[f'df_{i}']['Continent'] = dfs[f'df_{i}']['Code'].map(df_iso.set_index('alpha-3')['region'])
-    
-    # Filtrar linhas onde 'Code' não está presente em df_iso['alpha-3']
-    dfs[f'sub_df_{i}'] = dfs[f'df_{i}'][~dfs[f'df_{i}']['Code'].isin(df_iso['alpha-3'].str.upper())].reset_index(drop=True)
-    
-    # Filtrar linhas onde 'Code' está presente em df_iso['alpha-3'] e guardar num novo DataFrame
-    dfs[f'df_{i}'] = dfs[f'df_{i}'][dfs[f'df_{i}']['Code'].isin(df_iso['alpha-3'])].reset_index(drop=True)
-    
-    # Guardar o DataFrame como ficheiro CSV com um nome correspondente ao índice
-    dfs[f'df_{i}'].to_csv(f'data/clean_data/df_{i}.csv', index=False)
-    dfs[f'sub_df_{i}'].to_csv(f'data/clean_data/sub_df_{i}.csv', index=False)
+# Diferença relativa máxima aceite entre a 'Population' de sub-tabelas diferentes
+TOLERANCIA_POPULACAO = 1e-9
+
+# Número de exemplos guardados por violação
+EXEMPLOS_VIOLACAO = 3
+
+RELATORIO_VALIDACAO_PATH = 'data/cache/validacao.json'
+
+# Em modo estrito, um erro de validação interrompe a limpeza; no menu interativo as violações são apenas indicadas
+VALIDACAO_ESTRITA = False
+
+
+class ErroValidacao(Exception):
+    # Erro de validação dos dados limpos, com as violações encontradas
+
+    def __init__(self, violacoes):
+        super().__init__('; '.join(f"{v['verificacao']} em {v['tabela']} {v['coluna'] or ''}: {v['linhas']} linhas"
+                                   for v in violacoes if v['gravidade'] == 'erro'))
+        self.violacoes = violacoes
+
+
+def nova_validacao():
+    # Estado da validação ao longo dos blocos: ids das entidades, chaves (entidade × ano) e populações de cada
+    # sub-tabela e violações acumuladas por (verificação, tabela, coluna)
+    return {'ids': {}, 'chaves': {}, 'populacao': {}, 'violacoes': {}, 'esquemas': set()}
+
+
+def registar_violacao(validacao, verificacao, tabela, coluna, gravidade, linhas, exemplos):
+    violacao = validacao['violacoes'].setdefault((verificacao, tabela, coluna), {
+        'verificacao': verificacao, 'tabela': tabela, 'coluna': coluna, 'gravidade': gravidade, 'linhas': 0, 'exemplos': []})
+    violacao['linhas'] += int(linhas)
+    violacao['exemplos'] = (violacao['exemplos'] + exemplos)[:EXEMPLOS_VIOLACAO]
+    if gravidade == 'erro' and VALIDACAO_ESTRITA:
+        raise ErroValidacao(list(validacao['violacoes'].values()))
+
+
+def chaves_entidade_ano(validacao, entidades, anos):
+    # Chave inteira de cada linha (id da entidade × 10000 + ano), com ids atribuídos às entidades por ordem de chegada
+    posicoes, distintas = pd.factorize(entidades)
+    ids = np.array([validacao['ids'].setdefault(e, len(validacao['ids'])) for e in distintas], dtype='int64')
+    return ids[posicoes] * 10000 + anos
+
+
+def numeros(coluna):
+    # Conversão do texto para números; o to_numeric (que converte os valores não numéricos em NaN) é bastante mais
+    # lento, pelo que só é usado nas colunas com valores não numéricos
+    try:
+        return coluna.to_numpy().astype('float64')
+    except ValueError:
+        return pd.to_numeric(coluna, errors='coerce').to_numpy('float64')
+
+
+def validar_bloco(validacao, limpas, esquemas):
+    for i, partes in limpas.items():
+        tabela = f'df_{i}'
+
+        # Cabeçalho da sub-tabela, depois do índice herdado (verificado uma única vez por sub-tabela)
+        if i not in validacao['esquemas']:
+            validacao['esquemas'].add(i)
+            cabecalho = esquemas[i]['nomes'][1:len(COLUNAS_CABECALHO) + 1]
+            if cabecalho != COLUNAS_CABECALHO:
+                registar_violacao(validacao, 'cabecalho', tabela, None, 'erro', 0, [cabecalho])
+
+        # Países (df_i) e agregados (sub_df_i)
+        for pais, df in zip((True, False), partes):
+            if not len(df):
+                continue
+
+            # Anos e valores numéricos, dentro dos limites do tipo de métrica
+            anos = numeros(df['Year'])
+            for coluna in df.columns:
+                limites = [(minimo, maximo) for texto, minimo, maximo in LIMITES_VALORES if texto in coluna]
+                if coluna != 'Year' and not limites:
+                    continue
+                valores = numeros(df[coluna]) if coluna != 'Year' else anos
+                minimo, maximo = limites[0] if limites else (0, 9999)
+                for verificacao, invalidos in (('numerico', np.isnan(valores)), ('intervalo', (valores < minimo) | (valores > maximo))):
+                    if invalidos.any():
+                        linhas = np.flatnonzero(invalidos)
+                        exemplos = [[df['Entity'].iat[k], df['Year'].iat[k], df[coluna].iat[k]] for k in linhas[:EXEMPLOS_VIOLACAO]]
+                        registar_violacao(validacao, verificacao, tabela, coluna, 'erro', len(linhas), exemplos)
+
+            validos = ~np.isnan(anos)
+            populacao = numeros(df['Population'])[validos] if 'Population' in df else None
+            acumular_chaves(validacao, tabela, pais, df['Entity'].to_numpy()[validos], anos[validos].astype('int64'), populacao)
+
+
+def acumular_chaves(validacao, tabela, pais, entidades, anos, populacao=None):
+    # Chaves (entidade × ano) dos países e populações, para as verificações entre sub-tabelas no fim da limpeza;
+    # os agregados do GBD variam entre sub-tabelas, pelo que a cobertura só é verificada nos países
+    chaves = chaves_entidade_ano(validacao, entidades, anos)
+    if pais:
+        validacao['chaves'].setdefault(tabela, []).append(chaves)
+    if populacao is not None:
+        validacao['populacao'].setdefault(tabela, []).append((chaves, populacao))
+
+
+def acumular_chaves_cache(validacao, i):
+    # Chaves e populações de uma sub-tabela que não foi limpa nesta passagem, lidas da cache (sem ler o ficheiro em bruto)
+    for pais, nome in ((True, f'df_{i}'), (False, f'sub_df_{i}')):
+        df = ler_cache(nome)
+        populacao = valores_float64(df['Population']) if 'Population' in df else None
+        acumular_chaves(validacao, f'df_{i}', pais, df['Entity'].to_numpy(), df['Year'].to_numpy('int64'), populacao)
+
+
+def concluir_validacao(validacao):
+    # Verificações entre as sub-tabelas limpas nesta passagem; devolve a lista de violações
+    nomes_ids = np.array(list(validacao['ids']), dtype=object)
+
+    def exemplos(chaves):
+        return [[nomes_ids[c // 10000], int(c % 10000)] for c in chaves[:EXEMPLOS_VIOLACAO]]
+
+    # Cobertura: pares (Entity, Year) presentes em alguma sub-tabela e em falta noutra
+    chaves = {tabela: np.unique(np.concatenate(partes)) for tabela, partes in validacao['chaves'].items()}
+    if len(chaves) > 1:
+        todas = np.unique(np.concatenate(list(chaves.values())))
+        for tabela, presentes in chaves.items():
+            em_falta = np.setdiff1d(todas, presentes, assume_unique=True)
+            if len(em_falta):
+                registar_violacao(validacao, 'cobertura', tabela, 'Entity, Year', 'aviso', len(em_falta), exemplos(em_falta))
+
+    # Concordância da população entre cada par de sub-tabelas que a incluem
+    populacoes = {tabela: (np.concatenate([c for c, _ in partes]), np.concatenate([p for _, p in partes]))
+                  for tabela, partes in validacao['populacao'].items()}
+    nomes = sorted(populacoes)
+    for a, tabela_a in enumerate(nomes):
+        for tabela_b in nomes[a + 1:]:
+            (chaves_a, valores_a), (chaves_b, valores_b) = populacoes[tabela_a], populacoes[tabela_b]
+            comuns, ia, ib = np.intersect1d(chaves_a, chaves_b, return_indices=True)
+            diferentes = ~np.isclose(valores_a[ia], valores_b[ib], rtol=TOLERANCIA_POPULACAO, atol=0)
+            if diferentes.any():
+                registar_violacao(validacao, 'populacao', f'{tabela_a}/{tabela_b}', 'Population', 'erro',
+                                  diferentes.sum(), exemplos(comuns[diferentes]))
+
+    return list(validacao['violacoes'].values())
+
+
+def validar_csv_limpos(validacao, subtabelas):
+    # Validar os CSV limpos das sub-tabelas indicadas, quando são a fonte dos dados (sem o ficheiro em bruto) ou quando
+    # a última validação não corresponde aos dados atuais; os esquemas são os cabeçalhos dos próprios CSV
+    limpas = {i: (pd.read_csv(f'{CLEAN_DIR}/df_{i}.csv'), pd.read_csv(f'{CLEAN_DIR}/sub_df_{i}.csv')) for i in subtabelas}
+    esquemas = {i: {'nomes': [col for col in df.columns if col != 'Continent']} for i, (df, _) in limpas.items()}
+    validar_bloco(validacao, limpas, esquemas)
+    concluir_validacao(validacao)
+
+
+def executar_validacao(h, fonte, passos):
+    # Executar os passos da validação e guardar o relatório, identificado pelo hash dos dados validados, também quando
+    # um erro (em modo estrito) a interrompe; devolve a lista de violações
+    validacao = nova_validacao()
+    try:
+        passos(validacao)
+    except ErroValidacao as erro:
+        escrever_relatorio_validacao(h, fonte, erro.violacoes)
+        raise
+    violacoes = list(validacao['violacoes'].values())
+    escrever_relatorio_validacao(h, fonte, violacoes)
+    contar('violacoes', sum(v['linhas'] for v in violacoes))
+    return violacoes
+
+
+def escrever_relatorio_validacao(h, fonte, violacoes):
+    os.makedirs(os.path.dirname(RELATORIO_VALIDACAO_PATH), exist_ok=True)
+    with open(RELATORIO_VALIDACAO_PATH, 'w') as f:
+        json.dump({'hash': h, 'fonte': fonte, 'violacoes': violacoes}, f, indent=2, ensure_ascii=False,
+                  default=lambda v: v.item() if hasattr(v, 'item') else str(v))
+
+
+def ler_relatorio_validacao():
+    # None se ainda não houver relatório (ou se tiver o formato antigo, sem o hash dos dados validados)
+    if not os.path.exists(RELATORIO_VALIDACAO_PATH):
+        return None
+    with open(RELATORIO_VALIDACAO_PATH) as f:
+        relatorio = json.load(f)
+    return relatorio if isinstance(relatorio, dict) else None
+
+
+def tem_erros(violacoes):
+    return any(v['gravidade'] == 'erro' for v in violacoes)
+
+
+def relatorio_validacao():
+    # Relatório da validação dos dados atuais: o da última limpeza, se corresponder aos dados carregados; caso
+    # contrário (ex.: a cache já existia quando a validação foi introduzida), os CSV limpos são validados agora
+    obter_armazem()
+    manifesto = ler_manifesto()
+    relatorio = ler_relatorio_validacao()
+    if relatorio is None or relatorio['hash'] != manifesto['hash']:
+        subtabelas = {int(nome.rsplit('_', 1)[1]) for nome in manifesto['tabelas']}
+        with medir('validacao'):
+            executar_validacao(manifesto['hash'], 'CSV limpos', partial(validar_csv_limpos, subtabelas=subtabelas))
+        relatorio = ler_relatorio_validacao()
+    return relatorio
+
+
+def imprimir_relatorio_validacao(violacoes):
+    if not violacoes:
+        print('Validação: sem violações')
+        return
+    linhas = [(v['gravidade'], v['verificacao'], v['tabela'], v['coluna'], v['linhas'],
+               '; '.join(', '.join(map(str, exemplo)) for exemplo in v['exemplos'])) for v in violacoes]
+    print(tabulate(linhas, headers=['Gravidade', 'Verificação', 'Tabela', 'Coluna', 'Linhas', 'Exemplos'], tablefmt='fancy_grid'))
+
+# %% [markdown]
+# ##### 2.2.6. Cache binária dos dataframes limpos
+
+# %% [markdown]
+# Os dataframes limpos são também guardados num formato binário colunar (Feather, ou pickle quando o `pyarrow` não está instalado) com tipos explícitos: anos em `int16`, `Entity`/`Code`/`Continent` como categorias e valores em `float32` quando este reproduz exatamente os valores dos CSV (arredondados às suas 6 casas decimais), ficando os restantes em `float64`. A cache é identificada pelo hash dos ficheiros em bruto, pelo que só é reconstruída quando estes mudam; caso contrário os CSV não voltam a ser lidos.
+#
+# Quando os ficheiros em bruto mudam, é calculada uma impressão digital de cada sub-tabela (a partir das suas linhas no ficheiro em bruto e do ficheiro `iso_countries.csv`) e apenas as tabelas cuja impressão digital mudou são limpas e guardadas novamente.
+
+# %%
+# Pasta onde é guardada a cache e ficheiro com a descrição da cache atual
+CACHE_DIR = 'data/cache'
+MANIFESTO_PATH = f'{CACHE_DIR}/manifesto.json'
+
+# O formato Feather requer o pyarrow; sem ele a cache é guardada em formato pickle (o pyarrow só é procurado, não
+# importado, para não atrasar o arranque)
+FORMATO_CACHE = 'feather' if importlib.util.find_spec('pyarrow') is not None else 'pickle'
+
+# Versão do conteúdo da cache: quando muda a forma como as tabelas são guardadas, a cache anterior deixa de ser válida
+VERSAO_CACHE = 4
+
+# Colunas de texto guardadas como categorias
+COLUNAS_CATEGORICAS = ['Entity', 'Code', 'Continent']
+
+# Casas decimais dos valores nos CSV limpos: uma coluna só passa a float32 se, arredondada a estas casas decimais,
+# reproduzir exatamente os valores originais
+CASAS_DECIMAIS = 6
+
+
+# %%
+def hash_ficheiros(caminhos):
+    # Calcular um hash SHA-256 do conteúdo de todos os ficheiros, lendo-os por blocos
+    h = hashlib.sha256()
+    for caminho in caminhos:
+        with open(caminho, 'rb') as f:
+            for bloco in iter(partial(f.read, 1 << 20), b''):
+                h.update(bloco)
+    return h.hexdigest()
+
+
+# %%
+def sem_indice_herdado(df):
+    # A primeira coluna das tabelas limpas é o índice herdado do ficheiro em bruto (com nomes como 'index' ou '6468'),
+    # que não é um dado
+    return df.iloc[:, 1:] if df.columns[0] != 'Entity' else df
+
+
+def float32_sem_perda(valores):
+    # Os valores em float32, arredondados às casas decimais dos CSV, reproduzem exatamente os originais
+    return np.array_equal(np.round(valores.astype('float32').astype('float64'), CASAS_DECIMAIS), valores, equal_nan=True)
+
+
+def tipar_tabela(df):
+    df = sem_indice_herdado(df).copy()
+
+    for col in df.columns:
+        if col in COLUNAS_CATEGORICAS:
+            df[col] = df[col].astype('category')
+        elif col == 'Year':
+            df[col] = df[col].astype('int16')
+        elif pd.api.types.is_float_dtype(df[col]):
+            valores = df[col].to_numpy()
+
+            # Valores inteiros (ex.: 'Population') passam a inteiros; os restantes a float32 apenas se não houver perda de
+            # informação (ex.: as percentagens), caso contrário ficam em float64 (ex.: 'Depressive disorder rates')
+            if np.array_equal(valores, np.round(valores)):
+                df[col] = pd.to_numeric(df[col].astype('int64'), downcast='integer')
+            elif float32_sem_perda(valores):
+                df[col] = df[col].astype('float32')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    return df
+
+
+def valores_float64(coluna):
+    # Valores de uma coluna tipada em float64; os valores float32 são arredondados às casas decimais dos CSV, o que
+    # reproduz exatamente os valores originais (ex.: 0.245587 e não 0.245587006211281)
+    if coluna.dtype == 'float32':
+        return np.round(coluna.to_numpy('float64'), CASAS_DECIMAIS)
+    return coluna.to_numpy('float64')
+
+
+# %%
+def caminho_cache(nome):
+    return f'{CACHE_DIR}/{nome}.{"feather" if FORMATO_CACHE == "feather" else "pkl"}'
+
+
+def escrever_cache(nome, df):
+    if FORMATO_CACHE == 'feather':
+        df.to_feather(caminho_cache(nome))
+    else:
+        df.to_pickle(caminho_cache(nome))
+
+
+def ler_cache(nome):
+    if FORMATO_CACHE == 'feather':
+        return pd.read_feather(caminho_cache(nome))
+    return pd.read_pickle(caminho_cache(nome))
+
+
+def ler_manifesto():
+    # Devolver um manifesto vazio se a cache ainda não existir
+    if not os.path.exists(MANIFESTO_PATH):
+        return {}
+    with open(MANIFESTO_PATH) as f:
+        return json.load(f)
+
+
+def escrever_manifesto(manifesto):
+    with open(MANIFESTO_PATH, 'w') as f:
+        json.dump(manifesto, f, indent=2)
+
+
+def tabelas_derivadas(nomes, construir):
+    # Tabelas calculadas a partir dos dados limpos (estatísticas, agregados, ...), guardadas na cache com o hash dos
+    # dados de que foram calculadas; quando os dados mudam, o manifesto é reescrito e as tabelas voltam a ser calculadas
+    manifesto = ler_manifesto()
+    derivadas = manifesto.get('derivadas', {})
+    if all(derivadas.get(nome) == manifesto['hash'] and os.path.exists(caminho_cache(nome)) for nome in nomes):
+        return {nome: ler_cache(nome) for nome in nomes}
+
+    tabelas = construir()
+    for nome in nomes:
+        escrever_cache(nome, tabelas[nome])
+    escrever_manifesto({**manifesto, 'derivadas': {**derivadas, **{nome: manifesto['hash'] for nome in nomes}}})
+    return tabelas
+
+
+# %%
+def hash_subtabelas(caminho):
+    # Calcular um hash SHA-256 das linhas de cada sub-tabela do ficheiro em bruto, sem o carregar para um DataFrame
+    hashes = [hashlib.sha256()]
+    with open(caminho, newline='') as f:
+        leitor = csv.reader(f)
+
+        # O cabeçalho do ficheiro define as colunas da primeira sub-tabela
+        hashes[0].update('\x1f'.join(next(leitor)).encode())
+
+        for linha in leitor:
+            # Uma linha de cabeçalho (coluna 'Year' igual a 'Year') inicia uma nova sub-tabela
+            if len(linha) > 3 and linha[3] == 'Year':
+                hashes.append(hashlib.sha256())
+            hashes[-1].update('\x1f'.join(linha).encode())
+            hashes[-1].update(b'\n')
+
+    return [h.hexdigest() for h in hashes]
+
+
+# %%
+def impressoes_tabelas():
+    # Sem o ficheiro em bruto, cada CSV limpo é a fonte da tabela correspondente
+    if not os.path.exists(RAW_PATH):
+        nomes = sorted(f[:-4] for f in os.listdir(CLEAN_DIR) if f.endswith('.csv'))
+        return {nome: hash_ficheiros([f'{CLEAN_DIR}/{nome}.csv']) for nome in nomes}
+
+    # A limpeza de cada sub-tabela depende das suas linhas no ficheiro em bruto e dos códigos ISO
+    iso = hash_ficheiros([ISO_PATH])
+    impressoes = {}
+    for i, h in enumerate(hash_subtabelas(RAW_PATH)):
+        impressao = hashlib.sha256(f'{h}:{iso}'.encode()).hexdigest()
+        impressoes[f'df_{i}'] = impressao
+        impressoes[f'sub_df_{i}'] = impressao
+    return impressoes
+
+
+# %%
+def atualizar_cache():
+    # Sem o ficheiro em bruto, os CSV limpos já existentes passam a ser a fonte dos dados
+    if os.path.exists(RAW_PATH):
+        fontes = [RAW_PATH, ISO_PATH]
+    else:
+        fontes = sorted(os.path.join(CLEAN_DIR, f) for f in os.listdir(CLEAN_DIR) if f.endswith('.csv'))
+    with medir('hash'):
+        h = hash_ficheiros(fontes)
+
+    # Se os dados em bruto não mudaram, a cache existente continua válida e basta carregá-la
+    manifesto = ler_manifesto()
+    if manifesto.get('formato') != FORMATO_CACHE or manifesto.get('versao') != VERSAO_CACHE:
+        manifesto = {}
+    if manifesto.get('hash') == h and all(os.path.exists(caminho_cache(nome)) for nome in manifesto['tabelas']):
+        # Em modo estrito, os dados aceites pelo menu interativo apesar de erros de validação continuam a ser recusados
+        relatorio = ler_relatorio_validacao() if VALIDACAO_ESTRITA else None
+        if relatorio is not None and relatorio['hash'] == h and tem_erros(relatorio['violacoes']):
+            raise ErroValidacao(relatorio['violacoes'])
+        return manifesto['tabelas']
+
+    # Caso contrário, identificar as tabelas cuja sub-tabela de origem mudou
+    with medir('hash'):
+        impressoes = impressoes_tabelas()
+    anteriores = manifesto.get('impressoes', {})
+    alteradas = [nome for nome, impressao in impressoes.items()
+                 if anteriores.get(nome) != impressao or not os.path.exists(caminho_cache(nome))]
+
+    # Voltar a limpar (e validar) apenas as sub-tabelas alteradas; sem o ficheiro em bruto, são validados os CSV limpos
+    # que mudaram
+    if alteradas:
+        limpas = {int(nome.rsplit('_', 1)[1]) for nome in alteradas}
+        inalteradas = {int(nome.rsplit('_', 1)[1]) for nome in impressoes} - limpas
+
+        def passos(validacao):
+            # As verificações entre sub-tabelas incluem também as que não mudaram, a partir da cache
+            with medir('validacao'):
+                for i in inalteradas:
+                    acumular_chaves_cache(validacao, i)
+            if os.path.exists(RAW_PATH):
+                dividir_subtabelas(subtabelas=limpas, validacao=validacao)
+            else:
+                with medir('validacao'):
+                    validar_csv_limpos(validacao, limpas)
+
+        violacoes = executar_validacao(h, 'dados em bruto' if os.path.exists(RAW_PATH) else 'CSV limpos', passos)
+        if violacoes:
+            # Em stderr, para não misturar o aviso com a saída dos comandos (ex.: as linhas JSON dos benchmarks)
+            print(f"Validação: {len(violacoes)} {'violação' if len(violacoes) == 1 else 'violações'} nos dados limpos "
+                  f"(ver {RELATORIO_VALIDACAO_PATH})", file=sys.stderr)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for nome in alteradas:
+        with medir('cache', tabela=nome) as etapa:
+            df = tipar_tabela(pd.read_csv(f'{CLEAN_DIR}/{nome}.csv'))
+            escrever_cache(nome, df)
+            etapa['linhas'] = len(df)
+
+    # Guardar o manifesto apenas no fim, para que uma reconstrução interrompida não deixe a cache marcada como válida
+    tabelas = list(impressoes)
+    escrever_manifesto({'hash': h, 'formato': FORMATO_CACHE, 'versao': VERSAO_CACHE, 'tabelas': tabelas, 'impressoes': impressoes})
+
+    return tabelas
+
+
+# %% [markdown]
+# ##### 2.2.7. Carregamento compacto das tabelas
+
+# %% [markdown]
+# Lidas diretamente dos CSV, as tabelas limpas guardam `Entity`, `Code` e `Continent` como texto (uma cópia por tabela), todos os valores em `float64` (incluindo `Population`, escrita como `12412000.000000`) e o índice herdado do ficheiro em bruto como mais uma coluna. No modo compacto (`MODO_COMPACTO`, usado por omissão), as tabelas são lidas da cache já sem o índice herdado e com os valores reduzidos (secção 2.2.6). Além disso, as colunas de texto de todas as tabelas partilham um único dicionário de categorias por coluna, pelo que cada nome de país é guardado uma única vez. É este dicionário de `Entity` que dá a dimensão das entidades: a tabela de entidades (secção 2.3) tem uma linha por código presente nas tabelas, e o `entity_id` de cada linha é lido dos códigos das categorias, sem comparar nomes.
+#
+# As tabelas carregadas só existem durante a construção do armazenamento normalizado (secção 2.3), que é o que fica em memória: a tabela de factos (com os valores em `float32` apenas se nenhum se perder, a mesma regra das colunas da cache; nos dados atuais ficam em `float64`, uma vez que métricas como a `Population` não cabem em `float32` sem perda), as tabelas de entidades e de métricas, o índice e, depois do primeiro gráfico de linhas ou pedido de séries, a matriz das séries. A função `relatorio_memoria` compara a memória (`memory_usage(deep=True)`) das tabelas lidas dos CSV com a das tabelas no modo compacto (o pico do carregamento) e com a do que fica retido depois dele.
+
+# %%
+# Carregar as tabelas no modo compacto (cache tipada e dicionários partilhados) ou tal como estão nos CSV limpos
+MODO_COMPACTO = True
+
+
+def dimensoes_partilhadas(tabelas):
+    # Um único dicionário de categorias (CategoricalDtype) por coluna de texto, com os valores de todas as tabelas
+    dimensoes = {}
+    for col in COLUNAS_CATEGORICAS:
+        valores = set()
+        for df in tabelas.values():
+            if col in df:
+                valores.update(df[col].cat.categories if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].dropna())
+        dimensoes[col] = pd.CategoricalDtype(sorted(valores))
+    return dimensoes
+
+
+def compactar_tabelas(tabelas):
+    dimensoes = dimensoes_partilhadas(tabelas)
+    return {nome: df.astype({col: dimensoes[col] for col in COLUNAS_CATEGORICAS if col in df}) for nome, df in tabelas.items()}
+
+
+def carregar_tabelas(compacto=True):
+    nomes = atualizar_cache()
+    if not compacto:
+        return {nome: pd.read_csv(f'{CLEAN_DIR}/{nome}.csv') for nome in nomes}
+    return compactar_tabelas({nome: ler_cache(nome) for nome in nomes})
+
+
+def memoria_tabelas(tabelas):
+    # Memória total das tabelas (memory_usage(deep=True)), contando uma única vez cada dicionário de categorias partilhado
+    total, dicionarios = 0, {}
+    for df in tabelas.values():
+        total += int(df.memory_usage(deep=True).sum())
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                categorias = df[col].cat.categories
+                total -= int(categorias.memory_usage(deep=True))
+                dicionarios[id(categorias)] = int(categorias.memory_usage(deep=True))
+    return total + sum(dicionarios.values())
+
+
+def memoria_armazem(armazem, matriz=None):
+    # Elementos e memória de cada estrutura que fica em memória depois do carregamento
+    partes = [(nome, len(armazem[nome]), int(armazem[nome].memory_usage(deep=True).sum()))
+              for nome in ('entidades', 'metricas', 'factos')]
+    partes.append(('inicio', len(armazem['inicio']), armazem['inicio'].nbytes))
+    if matriz is not None:
+        partes.append(('matriz_series', matriz['valores'].size, matriz['valores'].nbytes + matriz['anos'].nbytes))
+    return partes
+
+
+def relatorio_memoria():
+    # Memória de cada tabela lida dos CSV e no modo compacto (carregamento) e das estruturas retidas depois dele
+    originais = carregar_tabelas(compacto=False)
+    compactas = carregar_tabelas(compacto=True)
+
+    linhas = []
+    for nome in originais:
+        antes = int(originais[nome].memory_usage(deep=True).sum())
+        depois = int(compactas[nome].memory_usage(deep=True).sum())
+        linhas.append({'Tabela': nome, 'Linhas': len(originais[nome]),
+                       'Colunas': f'{originais[nome].shape[1]} → {compactas[nome].shape[1]}',
+                       'Antes (MB)': antes / 2 ** 20, 'Depois (MB)': depois / 2 ** 20, 'Redução': 1 - depois / antes})
+
+    # Total com cada dicionário partilhado contado uma única vez (o memory_usage de cada tabela inclui-o por inteiro)
+    antes, depois = memoria_tabelas(originais), memoria_tabelas(compactas)
+    linhas.append({'Tabela': 'Total', 'Linhas': sum(len(df) for df in originais.values()), 'Colunas': '',
+                   'Antes (MB)': antes / 2 ** 20, 'Depois (MB)': depois / 2 ** 20, 'Redução': 1 - depois / antes})
+
+    # Estruturas retidas, comparadas com o total das tabelas lidas dos CSV
+    retidas = [{'Estrutura': nome, 'Elementos': n, 'Memória (MB)': memoria / 2 ** 20, 'Face aos CSV': memoria / antes}
+               for nome, n, memoria in memoria_armazem(obter_armazem(), obter_matriz_series())]
+    total = sum(linha['Memória (MB)'] for linha in retidas)
+    retidas.append({'Estrutura': 'Total retido', 'Elementos': '', 'Memória (MB)': total, 'Face aos CSV': total * 2 ** 20 / antes})
+    return {'carregamento': pd.DataFrame(linhas), 'retida': pd.DataFrame(retidas)}
+
+
+def imprimir_relatorio_memoria(relatorio):
+    print('Carregamento (tabelas descartadas depois de construído o armazenamento):')
+    print(tabulate(relatorio['carregamento'], headers='keys', tablefmt='fancy_grid', showindex=False,
+                   floatfmt=('', '', '', '.3f', '.3f', '.1%')))
+    print('Memória retida:')
+    print(tabulate(relatorio['retida'], headers='keys', tablefmt='fancy_grid', showindex=False,
+                   floatfmt=('', '', '.3f', '.1%')))
 
 
 # %% [markdown]
@@ -163,120 +977,1132 @@ for i in range(len(index_lst) - 1):
 # %% [markdown]
 # ##### Dataframes limpos
 
+# %% [markdown]
+# As tabelas limpas têm chaves repetidas (`Entity`, `Code`, `Year`, `Continent`) e a coluna `Population` aparece em duas delas. Por isso, depois de carregadas, são convertidas num único armazenamento normalizado:
+#
+# - uma tabela de entidades (países e agregados), com os metadados ISO de `iso_countries.csv`;
+# - uma tabela de métricas (cada coluna de valores das tabelas limpas);
+# - uma tabela de factos em formato longo (`entity_id`, `year`, `metric_id`, `value`), ordenada por entidade e ano;
+# - as chaves (entidade × ano) das linhas de cada tabela limpa (incluindo as linhas dos agregados de `sub_df_i`). Como a `Population` é uma única métrica partilhada por df_1 e df_2, são estas chaves, e não as métricas, que indicam que linhas pertencem a cada tabela.
+#
+# Como os factos de cada entidade ficam contíguos, um único índice (a posição onde começam os factos de cada entidade) serve todas as consultas, tabelas e gráficos.
+
+# %%
+# Colunas que identificam cada linha das tabelas limpas (as restantes são métricas)
+COLUNAS_CHAVE = ['Entity', 'Code', 'Year', 'Continent']
+
+# Metadados ISO guardados na tabela de entidades
+COLUNAS_ISO = ['name', 'alpha-2', 'alpha-3', 'region', 'sub-region', 'intermediate-region']
+
+
+# %%
+def chaves_linhas(ids, anos):
+    # Chave inteira de cada linha (entity_id × 10000 + ano)
+    return np.asarray(ids, dtype='int64') * 10000 + anos
+
+
+def construir_armazem(tabelas):
+    # Métricas de cada tabela, sem o índice herdado do ficheiro em bruto
+    tabelas = {nome: sem_indice_herdado(df) for nome, df in tabelas.items()}
+    metricas_tabela = {}
+    for nome, df in tabelas.items():
+        metricas_tabela[nome] = [col for col in df.columns if col not in COLUNAS_CHAVE]
+
+    # Tabela de métricas, sem repetir as que aparecem em mais do que uma tabela (ex.: 'Population')
+    nomes_metricas = list(dict.fromkeys(col for cols in metricas_tabela.values() for col in cols))
+    metricas = pd.DataFrame({'metric_id': np.arange(len(nomes_metricas), dtype='int16'), 'Metric': nomes_metricas})
+    id_metrica = dict(zip(nomes_metricas, metricas['metric_id']))
+
+    # As entidades são identificadas pelos códigos do dicionário partilhado de 'Entity' (secção 2.2.7); as tabelas lidas
+    # dos CSV passam primeiro a usar os mesmos dicionários
+    dimensoes = {col: {df[col].dtype for df in tabelas.values()} for col in ('Entity', 'Code')}
+    if any(len(tipos) > 1 or not isinstance(*tipos, pd.CategoricalDtype) for tipos in dimensoes.values()):
+        tabelas = compactar_tabelas(tabelas)
+    dimensoes = {col: next(iter(tabelas.values()))[col].dtype for col in ('Entity', 'Code')}
+    codigos = {nome: df['Entity'].cat.codes.to_numpy() for nome, df in tabelas.items()}
+
+    # Tabela de entidades, com uma linha por código presente nas tabelas e o 'Code' da sua primeira linha
+    presentes, primeira = np.unique(np.concatenate(list(codigos.values())), return_index=True)
+    codigos_iso = np.concatenate([df['Code'].cat.codes.to_numpy() for df in tabelas.values()])[primeira]
+    entidades = pd.DataFrame({'Entity': dimensoes['Entity'].categories[presentes].to_numpy(object),
+                              'Code': pd.Categorical.from_codes(codigos_iso, dtype=dimensoes['Code']).astype(object),
+                              'codigo': presentes})
+
+    # Primeiro os países (códigos ISO) e depois os agregados, cada grupo por ordem alfabética
+    entidades = entidades.merge(obter_iso()[COLUNAS_ISO], how='left', left_on='Code', right_on='alpha-3')
+    entidades['Continent'] = entidades['region']
+    entidades['agregado'] = entidades['alpha-3'].isna()
+    entidades = entidades.sort_values(['agregado', 'Entity'], ignore_index=True)
+    entidades.insert(0, 'entity_id', np.arange(len(entidades), dtype='int32'))
+    id_entidade = dict(zip(entidades['Entity'], entidades['entity_id']))
+
+    # entity_id de cada código do dicionário partilhado
+    id_codigo = np.full(len(dimensoes['Entity'].categories), -1, dtype='int32')
+    id_codigo[entidades.pop('codigo').to_numpy()] = entidades['entity_id'].to_numpy()
+
+    # Tabela de factos em formato longo, com uma linha por entidade, ano e métrica
+    partes = []
+    chaves_tabela = {}
+    for nome, df in tabelas.items():
+        ids = id_codigo[codigos[nome]]
+        anos = df['Year'].to_numpy('int16')
+        chaves_tabela.setdefault(nome.removeprefix('sub_'), []).append(chaves_linhas(ids, anos))
+        for col in metricas_tabela[nome]:
+            partes.append(pd.DataFrame({'entity_id': ids, 'year': anos, 'metric_id': np.full(len(df), id_metrica[col], dtype='int16'),
+                                        'value': valores_float64(df[col])}))
+    factos = pd.concat(partes, ignore_index=True)
+
+    # Ordenar por entidade, ano e métrica e remover os valores repetidos (a mesma métrica em duas tabelas)
+    factos = factos.sort_values(['entity_id', 'year', 'metric_id'], kind='stable', ignore_index=True)
+    factos = factos.drop_duplicates(['entity_id', 'year', 'metric_id'], ignore_index=True)
+
+    # Valores em float32 apenas se nenhum se perder, a mesma regra das colunas da cache (secção 2.2.6); como a coluna
+    # junta todas as métricas, basta uma que não caiba em float32 (ex.: 'Population' ou 'Depressive disorder rates') para ficar em float64
+    if float32_sem_perda(factos['value'].to_numpy()):
+        factos['value'] = factos['value'].astype('float32')
+
+    # Índice: posição da primeira linha de cada entidade na tabela de factos (e o total no fim)
+    inicio = np.searchsorted(factos['entity_id'].to_numpy(), np.arange(len(entidades) + 1))
+
+    # Manter apenas as métricas das tabelas de países (as tabelas 'sub_df_i' têm as mesmas colunas)
+    metricas_tabela = {nome: cols for nome, cols in metricas_tabela.items() if not nome.startswith('sub_')}
+
+    # Chaves ordenadas das linhas de cada tabela limpa (países de df_i e agregados de sub_df_i)
+    chaves_tabela = {nome: np.unique(np.concatenate(partes)) for nome, partes in chaves_tabela.items()}
+
+    return {
+        'entidades': entidades,
+        'metricas': metricas,
+        'factos': factos,
+        'inicio': inicio,
+        'id_entidade': id_entidade,
+        'id_metrica': id_metrica,
+        'metricas_tabela': metricas_tabela,
+        'chaves_tabela': chaves_tabela,
+    }
+
+
 # %%
-# Carregar o ficheiro CSV 'df_0.csv' localizado em 'data/clean_data/' para um DataFrame chamado df_0
-data_df_0 = pd.read_csv('data/clean_data/df_0.csv')
-df_0 = pd.DataFrame(data_df_0)
+# Armazenamento normalizado, construído apenas na primeira consulta
+armazem = None
+
+
+def obter_armazem():
+    global armazem
+    if armazem is None:
+        # Limpar os dados em bruto (apenas se mudaram desde a última execução), carregar as tabelas limpas a partir da cache
+        # e construir o armazenamento normalizado
+        tabelas = carregar_tabelas(MODO_COMPACTO)
+        with medir('carga') as etapa:
+            armazem = construir_armazem(tabelas)
+            etapa['linhas'] = len(armazem['factos'])
+    return armazem
+
+# %% [markdown]
+# ##### Consultas
+
+# %% [markdown]
+# A função `consultar` filtra os factos por métrica, entidade, intervalo de anos e tipo de entidade (países ou agregados) e devolve-os em formato longo ou, com `pivot=True`, em formato largo (uma coluna por métrica), como nas tabelas limpas originais. Com `tabela`, devolve apenas as linhas (entidade, ano) dessa tabela limpa e, por omissão, as suas métricas.
 
-# Carregar o ficheiro CSV 'df_1.csv' localizado em 'data/clean_data/' para um DataFrame chamado df_1
-data_df_1 = pd.read_csv('data/clean_data/df_1.csv')
-df_1 = pd.DataFrame(data_df_1)
+# %%
+def posicoes_entidades(ids):
+    # Posições na tabela de factos das linhas de várias entidades, a partir dos intervalos do índice
+    inicio = obter_armazem()['inicio'][ids]
+    tamanhos = obter_armazem()['inicio'][ids + 1] - inicio
+    deslocamentos = np.repeat(inicio - np.r_[0, np.cumsum(tamanhos)[:-1]], tamanhos)
+    return deslocamentos + np.arange(tamanhos.sum())
 
-# Carregar o ficheiro CSV 'sub_df_1.csv' localizado em 'data/clean_data/' para um DataFrame chamado sub_df_1
-data_sub_df_1 = pd.read_csv('data/clean_data/sub_df_1.csv')
-sub_df_1 = pd.DataFrame(data_sub_df_1)
 
-# Carregar o ficheiro CSV 'df_2.csv' localizado em 'data/clean_data/' para um DataFrame chamado df_2
-data_df_2 = pd.read_csv('data/clean_data/df_2.csv')
-df_2 = pd.DataFrame(data_df_2)
+# %%
+def linhas_tabela(tabela, entidades, anos):
+    # Máscara das linhas (entidade, ano) que existem na tabela limpa, por pesquisa binária nas suas chaves ordenadas
+    chaves_tabela = obter_armazem()['chaves_tabela'][tabela]
+    chaves = chaves_linhas(entidades, anos)
+    if not len(chaves_tabela):
+        return np.zeros(len(chaves), dtype=bool)
+    posicoes = np.minimum(np.searchsorted(chaves_tabela, chaves), len(chaves_tabela) - 1)
+    return chaves_tabela[posicoes] == chaves
+
+
+def consultar(metricas=None, entidades=None, anos=None, agregados=None, pivot=False, tabela=None):
+    armazem = obter_armazem()
+    factos = armazem['factos']
+    tabela_entidades = armazem['entidades']
+
+    # Selecionar as entidades pedidas (por nome) e/ou apenas países ou apenas agregados
+    ids = tabela_entidades['entity_id'].to_numpy()
+    if entidades is not None:
+        ids = np.array([armazem['id_entidade'][e] for e in entidades if e in armazem['id_entidade']], dtype='int32')
+    if agregados is not None:
+        ids = ids[tabela_entidades['agregado'].to_numpy()[ids] == agregados]
+    resultado = factos.iloc[posicoes_entidades(ids)]
+
+    # Apenas as linhas da tabela limpa pedida, com as suas métricas por omissão
+    if tabela is not None:
+        metricas = armazem['metricas_tabela'][tabela] if metricas is None else metricas
+        resultado = resultado[linhas_tabela(tabela, resultado['entity_id'].to_numpy(), resultado['year'].to_numpy())]
+
+    # Filtrar pelas métricas pedidas
+    if metricas is not None:
+        ids_metricas = [armazem['id_metrica'][m] for m in metricas]
+        resultado = resultado[resultado['metric_id'].isin(ids_metricas)]
+
+    # Filtrar por ano (um ano ou um intervalo (início, fim), inclusive)
+    if anos is not None:
+        inicio, fim = anos if isinstance(anos, tuple) else (anos, anos)
+        resultado = resultado[resultado['year'].between(inicio, fim)]
+    resultado = resultado.assign(value=valores_float64(resultado['value']))
+
+    # Formato largo: uma linha por entidade e ano, com uma coluna por métrica
+    if pivot:
+        nomes = armazem['metricas']['Metric'].to_numpy()
+        resultado = resultado.pivot(index=['entity_id', 'year'], columns='metric_id', values='value')
+        resultado.columns = nomes[resultado.columns]
+        # Com reindex, uma seleção sem factos (ex.: uma entidade desconhecida ou um agregado sem valores nesta tabela)
+        # devolve uma tabela vazia com as colunas pedidas
+        resultado = resultado.reindex(columns=metricas) if metricas is not None else resultado
+        resultado = resultado.reset_index()
+        colunas_valores = list(resultado.columns[2:])
+    else:
+        resultado = resultado.assign(Metric=armazem['metricas']['Metric'].to_numpy()[resultado['metric_id']])
+        resultado = resultado.rename(columns={'value': 'Value'})
+        colunas_valores = ['Metric', 'Value']
+
+    # Acrescentar os atributos das entidades a partir da tabela de entidades
+    atributos = tabela_entidades.iloc[resultado['entity_id'].to_numpy()]
+    return pd.DataFrame({
+        'Entity': atributos['Entity'].to_numpy(),
+        'Code': atributos['Code'].to_numpy(),
+        'Year': resultado['year'].to_numpy(),
+        **{col: resultado[col].to_numpy() for col in colunas_valores},
+        'Continent': atributos['Continent'].to_numpy(),
+    })
 
-# Carregar o ficheiro CSV 'df_3.csv' localizado em 'data/clean_data/' para um DataFrame chamado df_3
-data_df_3 = pd.read_csv('data/clean_data/df_3.csv')
-df_3 = pd.DataFrame(data_df_3)
+# %% [markdown]
+# ##### Resolução de nomes de países
+
+# %% [markdown]
+# As consultas procuram as entidades pelo nome exato (`Entity`). Para que o utilizador não tenha de escrever o nome exatamente como no dataset, os nomes escritos são resolvidos com um índice construído uma única vez a partir do nome (`Entity`) e do código (`Code`) de cada entidade e do nome e códigos ISO (`name`, `alpha-2` e `alpha-3` de `iso_countries.csv`):
+#
+# - os nomes são comparados sem distinguir maiúsculas, acentos e pontuação (`united states`, `USA`, `US` e `United States of America` dão todos `United States`);
+# - um início de nome com pelo menos quatro caracteres que só corresponda a uma entidade também é aceite (`portu` dá `Portugal`), com uma pesquisa binária na lista ordenada dos nomes (que faz o papel de uma trie); um início mais curto (ex.: `uk`) é apenas sugerido, para não ser aceite por engano;
+# - sem correspondência, são sugeridas as entidades com nomes mais parecidos, pelo número de trigramas (sequências de três caracteres) em comum, com um índice invertido trigrama → nomes.
+#
+# Numa lista de países separados por vírgulas, as partes consecutivas que juntas formam um nome conhecido (ex.: `Korea, Republic of`) são lidas como um único país.
+
+# %%
+# Semelhança mínima (coeficiente de Dice dos trigramas) para sugerir uma entidade e número máximo de sugestões
+LIMIAR_SEMELHANCA = 0.3
+MAXIMO_SUGESTOES = 5
+
+# Número mínimo de caracteres de um início de nome para ser aceite sem confirmação
+MINIMO_PREFIXO = 4
+
+# Colunas das entidades com nomes alternativos, por ordem de prioridade quando dois nomes coincidem
+COLUNAS_NOMES = ['Entity', 'Code', 'name', 'alpha-3', 'alpha-2']
+
+
+def normalizar_nome(texto):
+    # Minúsculas, sem acentos e com a pontuação substituída por espaços (ex.: "Côte d'Ivoire" → 'cote d ivoire')
+    texto = unicodedata.normalize('NFKD', str(texto).casefold())
+    texto = ''.join(c if c.isalnum() else ' ' for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+def trigramas(texto):
+    # Com espaços no início e no fim, para que o início e o fim do nome também contem
+    texto = f'  {texto} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def construir_resolvedor(entidades):
+    # Nome normalizado → entidade
+    nomes = {}
+    for coluna in COLUNAS_NOMES:
+        for nome, entidade in zip(entidades[coluna], entidades['Entity']):
+            if isinstance(nome, str) and normalizar_nome(nome):
+                nomes.setdefault(normalizar_nome(nome), entidade)
+
+    # Lista ordenada dos nomes (pesquisa por início de nome) e índice invertido trigrama → posições na lista
+    ordenados = sorted(nomes)
+    indice = {}
+    for posicao, nome in enumerate(ordenados):
+        for trigrama in trigramas(nome):
+            indice.setdefault(trigrama, []).append(posicao)
+
+    return {
+        'nomes': nomes,
+        'ordenados': ordenados,
+        'entidades': [nomes[nome] for nome in ordenados],
+        'trigramas': indice,
+        'tamanhos': [len(trigramas(nome)) for nome in ordenados],
+    }
+
+
+# Índice de nomes, construído apenas na primeira resolução
+resolvedor = None
+
+
+def obter_resolvedor():
+    global resolvedor
+    if resolvedor is None:
+        resolvedor = construir_resolvedor(obter_armazem()['entidades'])
+    return resolvedor
+
+
+def entidades_prefixo(texto):
+    # Entidades com algum nome começado pelo texto, sem repetições
+    indice = obter_resolvedor()
+    inicio = bisect_left(indice['ordenados'], texto)
+    fim = bisect_left(indice['ordenados'], texto + '\uffff')
+    return list(dict.fromkeys(indice['entidades'][inicio:fim]))
+
+
+def entidades_semelhantes(texto, n=MAXIMO_SUGESTOES):
+    # Entidades com os nomes com mais trigramas em comum com o texto (coeficiente de Dice), da mais para a menos parecida
+    indice = obter_resolvedor()
+    consulta = trigramas(texto)
+    comuns = {}
+    for trigrama in consulta:
+        for posicao in indice['trigramas'].get(trigrama, ()):
+            comuns[posicao] = comuns.get(posicao, 0) + 1
+
+    pontuacoes = sorted(((2 * c / (len(consulta) + indice['tamanhos'][posicao]), posicao) for posicao, c in comuns.items()),
+                        reverse=True)
+    semelhantes = {}
+    for pontuacao, posicao in pontuacoes:
+        if pontuacao < LIMIAR_SEMELHANCA or len(semelhantes) == n:
+            break
+        semelhantes.setdefault(indice['entidades'][posicao], None)
+    return list(semelhantes)
+
+
+def resolver_pais(texto):
+    # (entidade, sugestões): a entidade com esse nome ou código, ou a única com um nome começado pelo texto (com pelo
+    # menos MINIMO_PREFIXO caracteres); sem correspondência, None e as entidades com nomes começados pelo texto ou mais
+    # parecidos
+    chave = normalizar_nome(texto)
+    if not chave:
+        return None, []
+    if chave in obter_resolvedor()['nomes']:
+        return obter_resolvedor()['nomes'][chave], []
+    candidatos = entidades_prefixo(chave)
+    if len(candidatos) == 1 and len(chave) >= MINIMO_PREFIXO:
+        return candidatos[0], []
+    sugestoes = candidatos + [e for e in entidades_semelhantes(chave) if e not in candidatos]
+    return None, sugestoes[:MAXIMO_SUGESTOES]
+
+
+def resolver_paises(texto):
+    # Lista de (texto, entidade, sugestões) de uma lista de países separados por vírgulas; as partes consecutivas cujo
+    # texto junto é um nome conhecido (ex.: 'Korea, Republic of') formam um único país
+    partes = texto.split(',')
+    resultado = []
+    i = 0
+    while i < len(partes):
+        for j in range(len(partes), i + 1, -1):
+            junto = ','.join(partes[i:j])
+            if partes[i].strip() and partes[j - 1].strip() and normalizar_nome(junto) in obter_resolvedor()['nomes']:
+                resultado.append((junto.strip(), *resolver_pais(junto)))
+                i = j
+                break
+        else:
+            if partes[i].strip():
+                resultado.append((partes[i].strip(), *resolver_pais(partes[i])))
+            i += 1
+    return resultado
+
+
+def pedir_pais(pergunta='Qual o país: '):
+    # Pedir um país até ser reconhecido ou escolhido de entre as sugestões (pelo número); None se a resposta for vazia
+    sugestoes = []
+    while True:
+        resposta = input(pergunta).strip()
+        if not resposta:
+            return None
+        if resposta.isdigit() and 1 <= int(resposta) <= len(sugestoes):
+            return sugestoes[int(resposta) - 1]
+
+        pais, sugestoes = resolver_pais(resposta)
+        if pais is not None:
+            return pais
+        print(f'País não encontrado: {resposta}')
+        for i, sugestao in enumerate(sugestoes, 1):
+            print("[{}] - {}".format(i, sugestao))
+        pergunta = 'Qual o país (ou o número de uma sugestão): ' if sugestoes else pergunta
+
+# %% [markdown]
+# ##### Estatísticas agregadas
+
+# %% [markdown]
+# As estatísticas de `describe()` (contagem, média, desvio padrão, mínimo, quartis e máximo) das colunas de cada tabela limpa (df_0 a df_3) são calculadas de uma só vez para todas as entidades, continentes e anos. Os factos são ordenados por grupo e valor, e cada estatística é lida nas fronteiras dos grupos, pelo que os quartis não exigem uma ordenação por grupo. As estatísticas por continente e por ano incluem apenas os países.
+#
+# O resultado fica guardado na cache, associado ao hash dos dados do manifesto: quando os dados mudam, o manifesto é reescrito e as estatísticas são recalculadas na consulta seguinte. Assim, `tabela_describe` limita-se a ler uma tabela já calculada.
+
+# %%
+# Níveis de agregação das estatísticas e estatísticas calculadas (as mesmas de describe())
+NIVEIS_RESUMO = ['Entity', 'Continent', 'Year']
+ESTATISTICAS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+
+# %%
+def estatisticas_grupos(chaves, valores):
+    # describe() de cada grupo definido pelas 'chaves' (lista de arrays), num único passo vetorizado
+    ordem = np.lexsort((valores, *reversed(chaves)))
+    chaves = [chave[ordem] for chave in chaves]
+    valores = valores[ordem]
+
+    # Início, fim e tamanho de cada grupo na ordenação
+    fronteira = np.zeros(len(valores), dtype=bool)
+    fronteira[:1] = True
+    for chave in chaves:
+        fronteira[1:] |= chave[1:] != chave[:-1]
+    inicio = np.flatnonzero(fronteira)
+    n = np.diff(np.r_[inicio, len(valores)])
+    fim = inicio + n - 1
+
+    # Média e desvio padrão amostral (NaN nos grupos com um único valor, como no pandas)
+    media = np.add.reduceat(valores, inicio) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.add.reduceat((valores - np.repeat(media, n)) ** 2, inicio) / (n - 1))
+
+    # Quartis por interpolação linear entre os dois valores ordenados mais próximos
+    quartis = []
+    for q in (0.25, 0.5, 0.75):
+        posicao = (n - 1) * q
+        baixo = inicio + np.floor(posicao).astype('int64')
+        alto = np.minimum(baixo + 1, fim)
+        quartis.append(valores[baixo] + (valores[alto] - valores[baixo]) * (posicao - np.floor(posicao)))
+
+    estatisticas = np.column_stack([n, media, std, valores[inicio], *quartis, valores[fim]])
+    return [chave[inicio] for chave in chaves], estatisticas
+
+
+# %%
+def construir_resumos(armazem):
+    factos = armazem['factos']
+    entidade = factos['entity_id'].to_numpy()
+    ano = factos['year'].to_numpy()
+    metrica = factos['metric_id'].to_numpy()
+    valor = valores_float64(factos['value'])
+
+    # Colunas de cada tabela: 'Year' seguida das métricas, numeradas por ordem numa lista única
+    tabelas = list(armazem['metricas_tabela'])
+    nomes_colunas = []
+    partes = []
+    for t, (nome, metricas) in enumerate(armazem['metricas_tabela'].items()):
+        primeira = len(nomes_colunas)
+        nomes_colunas += ['Year'] + metricas
+        mapa = np.full(len(armazem['id_metrica']), -1)
+        mapa[[armazem['id_metrica'][m] for m in metricas]] = np.arange(primeira + 1, len(nomes_colunas))
+
+        # Factos das métricas da tabela nas linhas (entidade, ano) da própria tabela: a 'Population' é partilhada por
+        # df_1 e df_2, pelo que as métricas não bastam para saber a que tabela pertence cada linha
+        linhas = np.flatnonzero(mapa[metrica] >= 0)
+        linhas = linhas[np.isin(chaves_linhas(entidade[linhas], ano[linhas]), armazem['chaves_tabela'][nome])]
+
+        # 'Year': um valor por linha (entidade, ano) da tabela, como na tabela em formato largo
+        novas = linhas[np.r_[True, (entidade[linhas[1:]] != entidade[linhas[:-1]]) | (ano[linhas[1:]] != ano[linhas[:-1]])]]
+        partes.append((t, np.full(len(novas), primeira), novas, ano[novas].astype('float64')))
+
+        # Métricas: apenas os valores não nulos, como na contagem do describe()
+        linhas = linhas[~np.isnan(valor[linhas])]
+        partes.append((t, mapa[metrica[linhas]], linhas, valor[linhas]))
+
+    tabela = np.concatenate([np.full(len(linhas), t, dtype='int8') for t, _, linhas, _ in partes])
+    coluna = np.concatenate([colunas for _, colunas, _, _ in partes])
+    linhas = np.concatenate([linhas for _, _, linhas, _ in partes])
+    valores = np.concatenate([v for _, _, _, v in partes])
+
+    # Chave de cada nível: entidade, continente (códigos, -1 nos agregados e nos países sem região ISO, que ficam de fora
+    # para não serem lidos como o último continente) ou ano (apenas países)
+    entidades = armazem['entidades']
+    codigos_continente, continentes = pd.factorize(entidades['Continent'])
+    pais = ~entidades['agregado'].to_numpy()[entidade[linhas]]
+    niveis = {
+        'Entity': (entidade[linhas], entidades['Entity'].to_numpy(), np.ones(len(linhas), dtype=bool)),
+        'Continent': (codigos_continente[entidade[linhas]], np.asarray(continentes), codigos_continente[entidade[linhas]] >= 0),
+        'Year': (ano[linhas], None, pais),
+    }
+
+    resumos = {}
+    nomes_colunas = np.array(nomes_colunas, dtype=object)
+    for nivel, (chave, nomes, incluir) in niveis.items():
+        (t, k, c), estatisticas = estatisticas_grupos([tabela[incluir], chave[incluir], coluna[incluir]], valores[incluir])
+        resumo = pd.DataFrame({nivel: nomes[k] if nomes is not None else k, 'tabela': np.array(tabelas, dtype=object)[t],
+                               'coluna': nomes_colunas[c]})
+        resumo[ESTATISTICAS] = estatisticas
+
+        # Ordenar pela chave e pela tabela, mantendo as colunas pela ordem das tabelas limpas
+        resumos[nivel] = resumo.sort_values([nivel, 'tabela'], ignore_index=True)
+    return resumos
+
+
+# %%
+# Estatísticas agregadas, calculadas ou lidas da cache apenas na primeira consulta
+resumos = None
+
+
+def obter_resumos():
+    global resumos
+    if resumos is None:
+        armazem = obter_armazem()
+        nomes = {nivel: f'resumo_{nivel.lower()}' for nivel in NIVEIS_RESUMO}
+        with medir('resumos'):
+            tabelas = tabelas_derivadas(list(nomes.values()),
+                                        lambda: {nomes[nivel]: df for nivel, df in construir_resumos(armazem).items()})
+        resumos = {nivel: tabelas[nome].set_index([nivel, 'tabela']) for nivel, nome in nomes.items()}
+    return resumos
+
+
+def resumo(nome, chave, nivel='Entity'):
+    # Estatísticas das colunas da tabela 'nome' para uma entidade, continente ou ano, no formato de describe()
+    tabela = obter_resumos()[nivel]
+    if (chave, nome) not in tabela.index:
+        return pd.DataFrame(index=ESTATISTICAS)
+    return tabela.loc[(chave, nome)].set_index('coluna').T.rename_axis(None, axis=1)
+
+# %% [markdown]
+# ##### Agregados regionais
+
+# %% [markdown]
+# O ficheiro `iso_countries.csv` organiza os países numa hierarquia de regiões (`region`, `sub-region` e `intermediate-region`). Para comparar regiões sem voltar a percorrer os dados de cada país, os valores de todas as métricas são agregados de uma só vez para cada região de cada nível e cada ano, num cubo em formato longo (`level`, `region`, `parent`, `year`, `metric_id`, `value`, `countries`):
+#
+# - as taxas e percentagens são médias ponderadas pela população (`Population`, das tabelas df_1/df_2);
+# - as contagens (a própria população e o número de pessoas com depressão) são somadas.
+#
+# O cubo é guardado na cache como as estatísticas agregadas. A função `validar_cubo` compara os agregados com as linhas de agregados do GBD que a limpeza separa nas tabelas `sub_df_*`, para as regiões com correspondência direta. Com os dados atuais, as diferenças são inferiores a 0,5% nas sub-regiões (América do Norte e Australásia) e de 0,2% a 6% no total mundial.
+
+# %%
+# Níveis da hierarquia de regiões, do mais geral ao mais detalhado ('World' agrega todos os países)
+NIVEIS_REGIOES = ['World', 'region', 'sub-region', 'intermediate-region']
+
+# Regiões ISO com uma entidade equivalente nos agregados do GBD
+CORRESPONDENCIAS_GBD = [
+    ('World', 'World', 'World'),
+    ('sub-region', 'Northern America', 'North America'),
+    ('sub-region', 'Australia and New Zealand', 'Australasia'),
+]
+
+
+def metrica_aditiva(nome):
+    # As contagens somam-se entre países; as taxas e percentagens não
+    return nome == 'Population' or '(Number)' in nome
+
+
+# %%
+def construir_cubo(armazem):
+    factos = armazem['factos']
+    entidades = armazem['entidades']
+    nomes_metricas = armazem['metricas']['Metric'].to_numpy()
+
+    # Valores não nulos dos países
+    entidade = factos['entity_id'].to_numpy()
+    valor = valores_float64(factos['value'])
+    validos = ~entidades['agregado'].to_numpy()[entidade] & ~np.isnan(valor)
+    entidade, valor = entidade[validos], valor[validos]
+    metrica = factos['metric_id'].to_numpy()[validos]
+    anos, ano = np.unique(factos['year'].to_numpy()[validos], return_inverse=True)
+
+    # Peso de cada valor: a população do país nesse ano nas taxas e percentagens, 1 nas contagens
+    populacao = np.full((len(entidades), len(anos)), np.nan)
+    e_populacao = metrica == armazem['id_metrica']['Population']
+    populacao[entidade[e_populacao], ano[e_populacao]] = valor[e_populacao]
+    aditiva = np.array([metrica_aditiva(nome) for nome in nomes_metricas])
+    peso = np.where(aditiva[metrica], 1.0, populacao[entidade, ano])
+    com_peso = ~np.isnan(peso)
+
+    partes = []
+    for i, nivel in enumerate(NIVEIS_REGIOES):
+        # Código da região de cada entidade neste nível (-1 sem região) e região do nível anterior que a contém
+        if nivel == 'World':
+            codigos, regioes, pais = np.zeros(len(entidades), dtype='int64'), np.array(['World'], dtype=object), [None]
+        else:
+            codigos, regioes = pd.factorize(entidades[nivel])
+            regioes = np.asarray(regioes, dtype=object)
+            anterior = NIVEIS_REGIOES[i - 1]
+            pais = entidades.groupby(nivel)[anterior].first().reindex(regioes).to_numpy() if anterior != 'World' else ['World'] * len(regioes)
+
+        # Somas ponderadas por (região, ano, métrica), com uma chave inteira e np.bincount
+        incluir = com_peso & (codigos[entidade] >= 0)
+        chave = (codigos[entidade[incluir]] * len(anos) + ano[incluir]) * len(nomes_metricas) + metrica[incluir]
+        tamanho = len(regioes) * len(anos) * len(nomes_metricas)
+        somas = np.bincount(chave, weights=peso[incluir] * valor[incluir], minlength=tamanho)
+        pesos = np.bincount(chave, weights=peso[incluir], minlength=tamanho)
+        contagens = np.bincount(chave, minlength=tamanho)
+
+        presentes = np.flatnonzero(contagens)
+        regiao, resto = np.divmod(presentes, len(anos) * len(nomes_metricas))
+        a, m = np.divmod(resto, len(nomes_metricas))
+        partes.append(pd.DataFrame({
+            'level': nivel,
+            'region': regioes[regiao],
+            'parent': np.asarray(pais, dtype=object)[regiao],
+            'year': anos[a].astype('int16'),
+            'metric_id': m.astype('int16'),
+            'value': np.where(aditiva[m], somas[presentes], somas[presentes] / pesos[presentes]),
+            'countries': contagens[presentes].astype('int16'),
+        }))
+
+    return pd.concat(partes, ignore_index=True)
+
+
+# %%
+# Cubo de agregados regionais, calculado ou lido da cache apenas na primeira consulta
+cubo = None
+
+
+def obter_cubo():
+    global cubo
+    if cubo is None:
+        armazem = obter_armazem()
+        with medir('cubo') as etapa:
+            cubo = tabelas_derivadas(['cubo_regioes'], lambda: {'cubo_regioes': construir_cubo(armazem)})['cubo_regioes']
+            etapa['linhas'] = len(cubo)
+    return cubo
+
+
+def consultar_cubo(nivel='region', metricas=None, regioes=None, anos=None, pivot=False):
+    # Agregados de um nível da hierarquia, filtrados como em 'consultar' (formato longo ou, com pivot=True, largo)
+    armazem = obter_armazem()
+    resultado = obter_cubo()
+    resultado = resultado[resultado['level'] == nivel]
+    if metricas is not None:
+        resultado = resultado[resultado['metric_id'].isin([armazem['id_metrica'][m] for m in metricas])]
+    if regioes is not None:
+        resultado = resultado[resultado['region'].isin(regioes)]
+    if anos is not None:
+        inicio, fim = anos if isinstance(anos, tuple) else (anos, anos)
+        resultado = resultado[resultado['year'].between(inicio, fim)]
+
+    nomes = armazem['metricas']['Metric'].to_numpy()
+    if pivot:
+        resultado = resultado.pivot(index=['region', 'parent', 'year'], columns='metric_id', values='value')
+        resultado.columns = nomes[resultado.columns]
+        resultado = resultado[metricas] if metricas is not None else resultado
+        resultado = resultado.reset_index().rename_axis(None, axis=1)
+    else:
+        resultado = resultado.assign(Metric=nomes[resultado['metric_id']]).drop(columns=['level', 'metric_id'])
+        resultado = resultado[['region', 'parent', 'year', 'Metric', 'value', 'countries']]
+    return resultado.rename(columns={'region': 'Region', 'parent': 'Parent', 'year': 'Year', 'value': 'Value',
+                                     'countries': 'Countries'}).reset_index(drop=True)
+
+
+# %%
+def validar_cubo(correspondencias=CORRESPONDENCIAS_GBD):
+    # Diferença relativa entre o agregado calculado e o agregado do GBD, por região e métrica, ao longo dos anos
+    linhas = []
+    for nivel, regiao, entidade in correspondencias:
+        calculado = consultar_cubo(nivel, regioes=[regiao])
+        gbd = consultar(entidades=[entidade]).rename(columns={'Value': 'GBD'})
+        comparacao = calculado.merge(gbd[['Year', 'Metric', 'GBD']], on=['Year', 'Metric'])
+        comparacao['erro'] = (comparacao['Value'] - comparacao['GBD']).abs() / comparacao['GBD'].abs()
+        for metrica, grupo in comparacao.groupby('Metric', sort=False):
+            linhas.append({'Region': regiao, 'GBD': entidade, 'Metric': metrica, 'Years': len(grupo),
+                           'Erro médio (%)': grupo['erro'].mean() * 100, 'Erro máximo (%)': grupo['erro'].max() * 100})
+    return pd.DataFrame(linhas)
+
+# %% [markdown]
+# ##### Correlações e tendências
+
+# %% [markdown]
+# A questão 4 (a depressão está relacionada com o suicídio?) é respondida também numericamente, para todos os pares de métricas e não só para a taxa de depressão e a taxa de suicídio do gráfico de bolhas:
+#
+# - correlação de Pearson e reta de regressão de cada métrica (`y`) em cada outra métrica (`x`), ao longo dos anos;
+# - tendência de cada métrica: reta de regressão do valor no ano, com o declive também em percentagem do valor médio por ano.
+#
+# Ambas são calculadas para cada entidade (país ou agregado), para cada continente (juntando os anos de todos os seus países) e para o mundo (todos os países). Todas as regressões vêm das mesmas somas (`n`, Σx, Σy, Σx², Σy², Σxy), calculadas de uma só vez com operações NumPy sobre a matriz densa entidade × métrica × ano do gráfico de linhas (por blocos de `BLOCO_ENTIDADES` entidades). As somas dos continentes e do mundo são as somas das dos seus países. Os resultados são guardados na cache como as estatísticas agregadas.
+
+# %%
+# Número de entidades processadas de cada vez (limita a memória dos arrays entidade × par de métricas × ano)
+BLOCO_ENTIDADES = 256
+
+# Número mínimo de anos com valores para calcular uma correlação ou tendência
+MINIMO_PONTOS = 3
+
+# Níveis das correlações e tendências e par de métricas da questão 4 (o do gráfico de bolhas)
+NIVEIS_ANALISE = ['Entity', 'Continent', 'World']
+PAR_DEPRESSAO_SUICIDIO = ('Depressive disorder rates (number suffering per 100,000)', 'Suicide rate (deaths per 100,000 individuals)')
+
+
+def somas_regressao(x, y):
+    # Somas n, Σx, Σy, Σx², Σy² e Σxy ao longo do último eixo, apenas nas posições em que x e y têm valores
+    validos = ~(np.isnan(x) | np.isnan(y))
+    x, y = np.where(validos, x, 0.0), np.where(validos, y, 0.0)
+    return np.stack([validos.sum(-1), x.sum(-1), y.sum(-1), (x * x).sum(-1), (y * y).sum(-1), (x * y).sum(-1)], axis=-1)
+
+
+def regressao(somas):
+    # Correlação de Pearson e reta de regressão de y em x a partir das somas (NaN com poucos pontos ou sem variação)
+    n, sx, sy, sxx, syy, sxy = np.moveaxis(somas, -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vxx, vyy, cxy = sxx - sx * sx / n, syy - sy * sy / n, sxy - sx * sy / n
+        invalidos = (n < MINIMO_PONTOS) | (vxx <= 1e-12 * sxx) | (vyy <= 1e-12 * syy)
+        declive = np.where(invalidos, np.nan, cxy / vxx)
+        r = np.where(invalidos, np.nan, np.clip(cxy / np.sqrt(vxx * vyy), -1, 1))
+        ordenada = (sy - declive * sx) / n
+    return r, declive, ordenada
+
+
+# %%
+def construir_analise(armazem):
+    entidades = armazem['entidades']
+    nomes_metricas = armazem['metricas']['Metric'].to_numpy()
+    matriz = obter_matriz_series()
+    valores, anos = matriz['valores'], matriz['anos']
+    n_entidades, n_metricas, _ = valores.shape
+
+    # As somas são calculadas sobre valores centrados (na média de cada métrica e no ano médio), para evitar a perda de
+    # precisão com valores grandes como 'Population'; o centro é o mesmo para todas as entidades, para que as somas
+    # continuem a poder ser somadas entre países
+    with np.errstate(invalid='ignore'):
+        centro = np.nanmean(valores, axis=(0, 2))
+    tempo = (anos - anos.mean()).astype('float64')
+
+    # Somas de cada entidade para cada par de métricas (i < j) e para cada métrica em função do ano
+    i, j = np.triu_indices(n_metricas, 1)
+    somas_pares = np.zeros((n_entidades, len(i), 6))
+    somas_tendencias = np.zeros((n_entidades, n_metricas, 6))
+    for inicio in range(0, n_entidades, BLOCO_ENTIDADES):
+        bloco = valores[inicio:inicio + BLOCO_ENTIDADES] - centro[:, None]
+        somas_pares[inicio:inicio + BLOCO_ENTIDADES] = somas_regressao(bloco[:, i], bloco[:, j])
+        somas_tendencias[inicio:inicio + BLOCO_ENTIDADES] = somas_regressao(np.broadcast_to(tempo, bloco.shape), bloco)
+
+    # Somas dos continentes e do mundo: somas das dos seus países, com uma matriz de pertença continente × entidade
+    paises = ~entidades['agregado'].to_numpy()
+    continentes, grupos = pd.factorize(entidades['Continent'].where(paises))
+    pertenca = (continentes[None, :] == np.arange(len(grupos))[:, None]).astype('float64')
+    niveis = {
+        'Entity': (entidades['Entity'].to_numpy(), somas_pares, somas_tendencias),
+        'Continent': (np.asarray(grupos, dtype=object), np.tensordot(pertenca, somas_pares, 1), np.tensordot(pertenca, somas_tendencias, 1)),
+        'World': (np.array(['World'], dtype=object), somas_pares[None, paises].sum(1), somas_tendencias[None, paises].sum(1)),
+    }
+
+    # As somas de (x, y) dão também as de (y, x), trocando Σx com Σy e Σx² com Σy²
+    troca = [0, 2, 1, 4, 3, 5]
+    x, y = np.r_[i, j], np.r_[j, i]
+
+    correlacoes, tendencias = [], []
+    for nivel, (chaves, pares, tendencia) in niveis.items():
+        pares = np.concatenate([pares, pares[..., troca]], axis=1)
+
+        # Desfazer a centragem: y = ordenada + declive·x nos valores originais
+        r, declive, ordenada = regressao(pares)
+        ordenada = ordenada + centro[y] - declive * centro[x]
+        k, p = np.nonzero(pares[..., 0] > 0)
+        correlacoes.append(pd.DataFrame({
+            'level': nivel, 'key': chaves[k], 'x': nomes_metricas[x[p]], 'y': nomes_metricas[y[p]],
+            'n': pares[k, p, 0].astype('int32'), 'r': r[k, p], 'slope': declive[k, p], 'intercept': ordenada[k, p],
+        }))
+
+        # Tendências em função do ano, com o declive também em percentagem do valor médio
+        r, declive, ordenada = regressao(tendencia)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            media = tendencia[..., 2] / tendencia[..., 0] + centro
+        ordenada = ordenada + centro - declive * anos.mean()
+        k, m = np.nonzero(tendencia[..., 0] > 0)
+        tendencias.append(pd.DataFrame({
+            'level': nivel, 'key': chaves[k], 'metric': nomes_metricas[m], 'n': tendencia[k, m, 0].astype('int32'),
+            'mean': media[k, m], 'slope': declive[k, m], 'slope_pct': declive[k, m] / np.abs(media[k, m]) * 100,
+            'intercept': ordenada[k, m], 'r': r[k, m],
+        }))
+
+    return {'correlacoes': pd.concat(correlacoes, ignore_index=True), 'tendencias': pd.concat(tendencias, ignore_index=True)}
+
+
+# %%
+# Correlações e tendências, calculadas ou lidas da cache apenas na primeira consulta
+analise = None
+
+
+def obter_analise():
+    global analise
+    if analise is None:
+        armazem = obter_armazem()
+        with medir('analise'):
+            analise = tabelas_derivadas(['correlacoes', 'tendencias'], lambda: construir_analise(armazem))
+    return analise
+
+
+def filtrar_analise(tabela, nivel, chaves, **colunas):
+    # Linhas de um nível, filtradas pelas chaves (entidades ou continentes) e pelo valor de outras colunas
+    resultado = tabela[tabela['level'] == nivel]
+    if chaves is not None:
+        resultado = resultado[resultado['key'].isin(chaves)]
+    for coluna, valor in colunas.items():
+        if valor is not None:
+            resultado = resultado[resultado[coluna] == valor]
+    return resultado.drop(columns='level').rename(columns={'key': nivel}).reset_index(drop=True)
+
+
+def correlacoes(x=PAR_DEPRESSAO_SUICIDIO[0], y=PAR_DEPRESSAO_SUICIDIO[1], nivel='Continent', chaves=None):
+    # Correlação e reta de regressão de y em x (None para todas as métricas) em cada entidade, continente ou no mundo
+    return filtrar_analise(obter_analise()['correlacoes'], nivel, chaves, x=x, y=y)
+
+
+def tendencias(metrica=None, nivel='Continent', chaves=None):
+    # Tendência anual de uma métrica (None para todas) em cada entidade, continente ou no mundo
+    return filtrar_analise(obter_analise()['tendencias'], nivel, chaves, metric=metrica)
 
 # %% [markdown]
 # ##### 2.3.1. Gráficos
 
+# %% [markdown]
+# Cada gráfico é construído por uma função `figura_*` que não pede dados ao utilizador e devolve a figura, para poder ser usada tanto no menu interativo como na exportação em lote (secção 2.3.3). As funções chamadas pelo menu limitam-se a pedir os parâmetros e a mostrar a figura.
+#
+# Para os gráficos Plotly (mapa, bolhas e linhas), a parte estática de cada figura (layout, configuração geográfica, limites da escala de cores, subgráficos) é construída uma única vez numa figura modelo. Os pedidos seguintes copiam o modelo e apenas substituem os dados dos traços. As figuras prontas ficam numa cache LRU, indexada pelo tipo de gráfico e pelos parâmetros.
+
+# %%
+# Número máximo de figuras guardadas na cache
+CAPACIDADE_CACHE_FIGURAS = 32
+
+
+class CacheLRU:
+    # Cache com um número máximo de elementos: quando está cheia, é removido o elemento usado há mais tempo.
+    # Opcionalmente, os elementos expiram 'validade' segundos depois de guardados
+
+    def __init__(self, capacidade, validade=None):
+        self.capacidade = capacidade
+        self.validade = validade
+        self.dados = OrderedDict()
+
+    def obter(self, chave):
+        if chave not in self.dados:
+            return None
+        guardado, valor = self.dados[chave]
+        if self.validade is not None and time.monotonic() - guardado > self.validade:
+            del self.dados[chave]
+            return None
+        self.dados.move_to_end(chave)
+        return valor
+
+    def guardar(self, chave, valor):
+        self.dados[chave] = (time.monotonic(), valor)
+        self.dados.move_to_end(chave)
+        while len(self.dados) > self.capacidade:
+            self.dados.popitem(last=False)
+
+    def limpar(self):
+        self.dados.clear()
+
+
+# %%
+# Figuras já construídas, indexadas por (tipo de gráfico, parâmetro), e figuras modelo de cada tipo de gráfico
+figuras = CacheLRU(CAPACIDADE_CACHE_FIGURAS)
+modelos = {}
+
+
+def figura_em_cache(tipo, parametro, construir):
+    # Devolver a figura da cache ou construí-la e guardá-la (as figuras devolvidas não devem ser alteradas)
+    fig = figuras.obter((tipo, parametro))
+    if fig is None:
+        with medir(f'figura.{tipo}', parametro=parametro):
+            fig = construir(parametro)
+        figuras.guardar((tipo, parametro), fig)
+    else:
+        contar(f'figura.{tipo}.cache')
+    return fig
+
+
+def copiar_modelo(tipo):
+    # Nova figura com o layout e os traços do modelo, cujos dados são depois substituídos
+    import plotly.graph_objects as go
+
+    modelo = modelos[tipo]['figura']
+    return go.Figure(data=modelo.data, layout=modelo.layout)
+
+
 # %% [markdown]
 # A. Mapa do mundo com estatísticas para a depressão ao longo do tempo
 
 # %%
-import plotly.express as px
+def modelo_mapa():
+    import plotly.express as px
+
+    if 'mapa' not in modelos:
+        # Obter a percentagem de depressão de todos os países em todos os anos
+        data = consultar(metricas=['Depression (%)'], agregados=False, pivot=True)
+
+        # Criar um gráfico de mapa de choropleth utilizando o Plotly Express
+        fig = px.choropleth(data,  # DataFrame de dados
+                            locations='Code',  # Coluna do DataFrame que contém os códigos de localização
+                            color='Depression (%)',  # Coluna do DataFrame que contém os valores para atribuir cor
+                            scope="world",  # Scope geográfico do mapa (neste caso, mundial)
+                            hover_name='Entity',  # Coluna do DataFrame usada para rótulos ao passar o rato sobre as áreas
+                            color_continuous_scale=px.colors.sequential.Plasma)  # Esquema de cores contínuas
+
+        # Atualizar o layout do gráfico; os limites da escala de cores são os de todos os anos, para que os mapas de anos diferentes sejam comparáveis
+        fig.update_layout(
+            font=dict(family="Arial", size=12),
+            margin=dict(l=5, r=5, t=50, b=5),
+            coloraxis=dict(cmin=data['Depression (%)'].min(), cmax=data['Depression (%)'].max()),  # Configurar os limites da escala de cores
+            height=700
+        )
+
+        # Atualizar as configurações geográficas para ajustar os limites de exibição
+        fig.update_geos(fitbounds="locations", visible=False)
+
+        modelos['mapa'] = {'figura': fig, 'data': data}
+    return modelos['mapa']
+
+
+def construir_mapa(ano):
+    import plotly.express as px
+
+    data = modelo_mapa()['data']
+
+    # Sem ano, o mapa é animado ao longo de todos os anos, com o layout do modelo
+    if ano is None:
+        fig = px.choropleth(data, locations='Code', color='Depression (%)', scope="world", hover_name='Entity',
+                            color_continuous_scale=px.colors.sequential.Plasma,
+                            animation_frame='Year',  # Coluna do DataFrame usada para a animação ao longo do tempo
+                            animation_group='Entity')  # Coluna do DataFrame usada para agrupar áreas durante a animação
+        fig.update_layout(modelos['mapa']['figura'].layout)
+        fig.update_layout(title="Mapa Mundial da Depressão (%) ao longo dos anos")
+        return fig
+
+    # Com ano, copiar o modelo e substituir apenas os dados do traço
+    data = data[data['Year'] == ano]
+    fig = copiar_modelo('mapa')
+    fig.update_traces(locations=data['Code'], z=data['Depression (%)'], hovertext=data['Entity'])
+    fig.update_layout(title=f"Mapa Mundial da Depressão (%) em {ano}")
+    return fig
+
+
+def figura_mapa(ano=None):
+    return figura_em_cache('mapa', ano, construir_mapa)
+
 
 def mapa():
-    # Criar um gráfico de mapa de choropleth utilizando o Plotly Express
-    fig = px.choropleth(df_0,  # DataFrame de dados
-                        locations='Code',  # Coluna do DataFrame que contém os códigos de localização
-                        color='Depression (%)',  # Coluna do DataFrame que contém os valores para atribuir cor
-                        scope="world",  # Scope geográfico do mapa (neste caso, mundial)
-                        hover_name='Entity',  # Coluna do DataFrame usada para rótulos ao passar o rato sobre as áreas
-                        color_continuous_scale=px.colors.sequential.Plasma,  # Esquema de cores contínuas
-                        animation_frame='Year',  # Coluna do DataFrame usada para a animação ao longo do tempo
-                        animation_group='Entity')  # Coluna do DataFrame usada para agrupar áreas durante a animação
+    # Exibir o gráfico
+    figura_mapa().show()
+
+
+# %% [markdown]
+# B.  Gráfico da relação da Taxa de Depressão com a Taxa de Suicídio no mundo
+
+# %%
+def modelo_bolhas():
+    import plotly.express as px
+
+    if 'bolhas' not in modelos:
+        # Obter as taxas de depressão e suicídio e a população de todos os países em todos os anos
+        data = consultar(metricas=['Depressive disorder rates (number suffering per 100,000)',
+                                   'Suicide rate (deaths per 100,000 individuals)', 'Population'],
+                         agregados=False, pivot=True, tabela='df_2')
+
+        # Criar um gráfico de dispersão com bolhas utilizando o Plotly Express (um traço por continente)
+        fig = px.scatter(
+            data,  # DataFrame de dados
+            x="Depressive disorder rates (number suffering per 100,000)",  # Eixo x: Taxa de transtorno depressivo
+            y="Suicide rate (deaths per 100,000 individuals)",  # Eixo y: Taxa de suicídio
+            size="Population",  # Tamanho das bolhas baseado na coluna 'Population'
+            color="Continent",  # Cor das bolhas baseada na coluna 'Continent'
+            hover_name="Entity",  # Rótulo ao passar o rato sobre as bolhas
+            facet_col="Continent",  # Criar subgráficos separados por continente
+            log_x=True,  # Usar escala logarítmica no eixo x
+            size_max=50,  # Tamanho máximo das bolhas
+            range_x=[2000, 6000],  # Faixa de valores no eixo x
+            range_y=[0, 60]  # Faixa de valores no eixo y
+        )
+
+        # Atualizar os eixos x
+        fig.update_xaxes(
+            tickangle=90,  # Ângulo de inclinação dos rótulos no eixo x
+            title_text="Taxa de Transtorno Depressivo",  # Título do eixo x
+            title_font={"size": 12},  # Tamanho da fonte do título do eixo x
+            title_standoff=25  # Distância entre o título e o eixo x
+        )
+
+        modelos['bolhas'] = {'figura': fig, 'data': data}
+    return modelos['bolhas']
+
+
+def construir_bolhas(ano):
+    import plotly.express as px
+
+    data = modelo_bolhas()['data']
+
+    # Sem ano, o gráfico é animado ao longo de todos os anos, com o layout do modelo
+    if ano is None:
+        fig = px.scatter(data, x="Depressive disorder rates (number suffering per 100,000)",
+                         y="Suicide rate (deaths per 100,000 individuals)", size="Population", color="Continent",
+                         hover_name="Entity", facet_col="Continent", log_x=True, size_max=50,
+                         range_x=[2000, 6000], range_y=[0, 60],
+                         animation_frame="Year",  # Coluna do DataFrame usada para a animação ao longo do tempo
+                         animation_group="Entity")  # Coluna do DataFrame usada para agrupar pontos durante a animação
+        fig.update_layout(modelos['bolhas']['figura'].layout)
+        titulo = "Gráfico ilustrando a relação global entre Taxas de Depressão e Suicídio"
+    else:
+        # Com ano, copiar o modelo e substituir apenas os dados de cada traço (um por continente)
+        data = data[data['Year'] == ano]
+        fig = copiar_modelo('bolhas')
+        for traco in fig.data:
+            parte = data[data['Continent'] == traco.name]
+            traco.update(x=parte["Depressive disorder rates (number suffering per 100,000)"],
+                         y=parte["Suicide rate (deaths per 100,000 individuals)"],
+                         marker_size=parte["Population"], hovertext=parte["Entity"])
+        titulo = f"Gráfico ilustrando a relação global entre Taxas de Depressão e Suicídio em {ano}"
 
     # Atualizar o layout do gráfico
     fig.update_layout(
-        title=f"Mapa Mundial da Depressão (%) ao longo dos anos",
-        font=dict(family="Arial", size=12),
-        margin=dict(l=5, r=5, t=50, b=5),
-        coloraxis=dict(cmin=df_0['Depression (%)'].min(), cmax=df_0['Depression (%)'].max()),  # Configurar os limites da escala de cores
-        height=700
+        title=dict(text=titulo, font=dict(size=20), yref='paper')  # Título do gráfico
     )
-    
-    # Atualizar as configurações geográficas para ajustar os limites de exibição
-    fig.update_geos(fitbounds="locations", visible=False)
-    
+
+    return fig
+
+
+def figura_bolhas(ano=None):
+    return figura_em_cache('bolhas', ano, construir_bolhas)
+
+
+def bolhas():
     # Exibir o gráfico
-    fig.show()
+    figura_bolhas().show()
 
 
 # %% [markdown]
-# B.  Gráfico da relação da Taxa de Depressão com a Taxa de Suicídio no mundo
+# O mesmo gráfico ao nível das sub-regiões ISO, com os valores do cubo de agregados regionais (taxas ponderadas pela população e população total de cada sub-região), um subgráfico por continente.
 
 # %%
-def bolhas():
-    # Criar um gráfico de dispersão com bolhas utilizando o Plotly Express
-    fig = px.scatter(
-        df_2,  # DataFrame de dados
-        x="Depressive disorder rates (number suffering per 100,000)",  # Eixo x: Taxa de transtorno depressivo
-        y="Suicide rate (deaths per 100,000 individuals)",  # Eixo y: Taxa de suicídio
-        animation_frame="Year",  # Coluna do DataFrame usada para a animação ao longo do tempo
-        animation_group="Entity",  # Coluna do DataFrame usada para agrupar pontos durante a animação
-        size="Population",  # Tamanho das bolhas baseado na coluna 'Population'
-        color="Continent",  # Cor das bolhas baseada na coluna 'Continent'
-        hover_name="Entity",  # Rótulo ao passar o rato sobre as bolhas
-        facet_col="Continent",  # Criar subgráficos separados por continente
-        log_x=True,  # Usar escala logarítmica no eixo x
-        size_max=50,  # Tamanho máximo das bolhas
-        range_x=[2000, 6000],  # Faixa de valores no eixo x
-        range_y=[0, 60]  # Faixa de valores no eixo y
-    )
+def construir_bolhas_regioes(ano):
+    import plotly.express as px
 
-    # Atualizar os eixos x
-    fig.update_xaxes(
-        tickangle=90,  # Ângulo de inclinação dos rótulos no eixo x
-        title_text="Taxa de Transtorno Depressivo",  # Título do eixo x
-        title_font={"size": 12},  # Tamanho da fonte do título do eixo x
-        title_standoff=25  # Distância entre o título e o eixo x
-    )
+    # Obter as taxas e a população de cada sub-região (num ano ou em todos os anos)
+    data = consultar_cubo('sub-region', metricas=['Depressive disorder rates (number suffering per 100,000)',
+                                                  'Suicide rate (deaths per 100,000 individuals)', 'Population'],
+                          anos=ano, pivot=True)
 
-    # Atualizar o layout do gráfico
-    fig.update_layout(
-        title=dict(text="Gráfico ilustrando a relação global entre Taxas de Depressão e Suicídio", font=dict(size=20), yref='paper')  # Título do gráfico
-    )
+    # Sem ano, o gráfico é animado ao longo de todos os anos
+    animacao = dict(animation_frame="Year", animation_group="Region") if ano is None else {}
+    fig = px.scatter(data, x="Depressive disorder rates (number suffering per 100,000)",
+                     y="Suicide rate (deaths per 100,000 individuals)", size="Population", color="Parent",
+                     hover_name="Region", facet_col="Parent", log_x=True, size_max=50,
+                     range_x=[2000, 6000], range_y=[0, 60], **animacao)
+
+    # Atualizar os eixos x e o título como no gráfico por país
+    fig.update_xaxes(tickangle=90, title_text="Taxa de Transtorno Depressivo", title_font={"size": 12}, title_standoff=25)
+    titulo = "Relação entre Taxas de Depressão e Suicídio por sub-região"
+    fig.update_layout(title=dict(text=titulo if ano is None else f"{titulo} em {ano}", font=dict(size=20), yref='paper'))
 
+    return fig
+
+
+def figura_bolhas_regioes(ano=None):
+    return figura_em_cache('bolhas_regioes', ano, construir_bolhas_regioes)
+
+
+def bolhas_regioes():
     # Exibir o gráfico
-    fig.show()
+    figura_bolhas_regioes().show()
 
 # %% [markdown]
 # C. Gráfico de barras com a Pervalência de Depressão em homens e mulheres no mundo (Top 20)
 
+# %% [markdown]
+# Os países são ordenados uma única vez por ano, pela prevalência média em homens e mulheres (ou por qualquer outra métrica), num índice de classificação: os países de cada ano ficam contíguos e por ordem decrescente, pelo que o top N de qualquer ano é uma fatia do índice. Para obter o top N de todos os anos de uma vez, `top_n_todos_anos` usa uma seleção parcial (`np.argpartition`) sobre a matriz anos × países, sem ordenar cada ano por completo.
+
 # %%
-def barras():
+# Prevalência em homens e mulheres, usada no gráfico de barras, e critério de ordenação por omissão (a média das duas)
+PREVALENCIAS = ['Prevalence in males (%)', 'Prevalence in females (%)']
+MEDIA_PREVALENCIA = 'Média da Prevalência'
+
+# Índices de classificação já construídos, por critério
+classificacoes = {}
+
+
+def valores_criterio(criterio):
+    # Valor do critério para cada país e ano (a prevalência média ou uma métrica das tabelas limpas)
+    # e as métricas de que depende
+    metricas = PREVALENCIAS if criterio == MEDIA_PREVALENCIA else [criterio]
+    dados = consultar(metricas=metricas, agregados=False, pivot=True)
+    componentes = {m: dados[m].to_numpy() for m in metricas}
+    valores = (componentes[PREVALENCIAS[0]] + componentes[PREVALENCIAS[1]]) / 2 if criterio == MEDIA_PREVALENCIA else componentes[criterio]
+
+    ids = dados['Entity'].map(obter_armazem()['id_entidade']).to_numpy('int32')
+    validos = ~np.isnan(valores)
+    return ids[validos], dados['Year'].to_numpy()[validos], valores[validos], {m: v[validos] for m, v in componentes.items()}
+
+
+def classificacao(criterio=MEDIA_PREVALENCIA):
+    if criterio not in classificacoes:
+        ids, anos, valores, componentes = valores_criterio(criterio)
+
+        # Ordenar por ano e, dentro de cada ano, por valor decrescente
+        ordem = np.lexsort((-valores, anos))
+        anos = anos[ordem]
+        anos_unicos = np.unique(anos)
+
+        classificacoes[criterio] = {
+            'anos': anos_unicos,
+            'inicio': np.searchsorted(anos, np.r_[anos_unicos, anos_unicos[-1] + 1]),
+            'entity_id': ids[ordem],
+            'valor': valores[ordem],
+            'componentes': {m: v[ordem] for m, v in componentes.items()},
+        }
+    return classificacoes[criterio]
+
+
+def top_n(ano, n=20, criterio=MEDIA_PREVALENCIA):
+    # Países com maior valor do critério no ano indicado, por ordem decrescente: uma fatia do índice
+    indice = classificacao(criterio)
+    i = np.searchsorted(indice['anos'], ano)
+    if i == len(indice['anos']) or indice['anos'][i] != ano:
+        fatia = slice(0, 0)
+    else:
+        fatia = slice(indice['inicio'][i], min(indice['inicio'][i] + n, indice['inicio'][i + 1]))
+
+    # Mesmas colunas que as consultas em formato largo, com o valor do critério no fim
+    entidades = obter_armazem()['entidades'].iloc[indice['entity_id'][fatia]]
+    colunas = {'Entity': entidades['Entity'].to_numpy(), 'Code': entidades['Code'].to_numpy(),
+               'Year': np.full(len(entidades), ano, dtype='int16')}
+    colunas.update({m: v[fatia] for m, v in indice['componentes'].items()})
+    colunas['Continent'] = entidades['Continent'].to_numpy()
+    if criterio == MEDIA_PREVALENCIA:
+        colunas[criterio] = indice['valor'][fatia]
+    return pd.DataFrame(colunas)
+
+
+def top_n_todos_anos(n=20, criterio=MEDIA_PREVALENCIA):
+    # Top N de todos os anos num único passo: seleção parcial dos n maiores valores em cada linha da matriz anos × países
+    ids, anos, valores, _ = valores_criterio(criterio)
+    anos_unicos, linha = np.unique(anos, return_inverse=True)
+    matriz = np.full((len(anos_unicos), len(obter_armazem()['entidades'])), -np.inf)
+    matriz[linha, ids] = valores
+
+    n = min(n, matriz.shape[1])
+    colunas = np.argpartition(-matriz, n - 1, axis=1)[:, :n]
+
+    # Ordenar apenas os n selecionados de cada ano e descartar os países sem valor
+    selecionados = np.take_along_axis(matriz, colunas, axis=1)
+    ordem = np.argsort(-selecionados, axis=1, kind='stable')
+    colunas = np.take_along_axis(colunas, ordem, axis=1)
+    selecionados = np.take_along_axis(selecionados, ordem, axis=1)
+    validos = np.isfinite(selecionados)
+
+    entidades = obter_armazem()['entidades'].iloc[colunas[validos]]
+    return pd.DataFrame({
+        'Year': np.repeat(anos_unicos, validos.sum(axis=1)),
+        'Posição': np.nonzero(validos)[1] + 1,
+        'Entity': entidades['Entity'].to_numpy(),
+        'Code': entidades['Code'].to_numpy(),
+        criterio: selecionados[validos],
+    })
+
+
+def dados_barras(year, n=20):
+    # Os n países com maior prevalência média no ano especificado, com a prevalência em homens e mulheres
+    return top_n(year, n)
+
+
+def figura_barras(year):
+    import matplotlib.pyplot as plt
+
     # Criar uma figura e eixo com um tamanho específico
     fig, ax = plt.subplots(figsize=(6, 6))
     
-    # Entrada para o ano
-    year = int(input('Ano: '))
-    
-    # Filtrar dados para o ano especificado
-    data_year = df_1[df_1['Year'] == year]
-    
-    # Calcular a prevalência média para homens e mulheres
-    data_year['Média da Prevalência'] = (data_year['Prevalence in males (%)'] + data_year['Prevalence in females (%)']) / 2
-    
-    # Ordenar por prevalência média em ordem decrescente
-    data_year = data_year.sort_values(by='Média da Prevalência', ascending=False).head(20)
+    # Os 20 países com maior prevalência média no ano especificado
+    data_year = dados_barras(year)
     
     # Criar gráficos de barras para homens e mulheres separadamente
     bar_height = 0.8 
@@ -291,16 +2117,17 @@ def barras():
     for i, valor in enumerate(data_year['Prevalence in females (%)']):
         ax.text(valor, i, f'{valor:.2f}%', ha='left', va='center', color='darkorange', fontweight='bold')
     
-    # Adicionar uma barra para o mundo
-    world_values = sub_df_1[(sub_df_1['Entity'] == 'World') & (sub_df_1['Year'] == year)]
-    world_male_value = world_values['Prevalence in males (%)'].values[0]
-    world_female_value = world_values['Prevalence in females (%)'].values[0]
-    ax.barh('Mundo',world_male_value, height=bar_height, color='#00E676', alpha=0.3, label='Mundo Homens')
-    ax.barh('Mundo', world_female_value, left=world_male_value, height=bar_height, color='#CDDC39', alpha=0.3, label='Mundo Mulheres')
-
-    # Adicionar rótulos de percentagem para o mundo
-    ax.text(world_male_value, len(data_year), f'{world_male_value:.2f}%', ha='right', va='center', color='#00E676', fontweight='bold')
-    ax.text(world_female_value, len(data_year), f'{world_female_value:.2f}%', ha='left', va='center', color='#CDDC39', fontweight='bold')
+    # Adicionar uma barra para o mundo (apenas se houver valores do mundo nesse ano)
+    world = consultar(metricas=PREVALENCIAS, entidades=['World'], anos=year, pivot=True)
+    if len(world):
+        world_male_value = world['Prevalence in males (%)'].iloc[0]
+        world_female_value = world['Prevalence in females (%)'].iloc[0]
+        ax.barh('Mundo',world_male_value, height=bar_height, color='#00E676', alpha=0.3, label='Mundo Homens')
+        ax.barh('Mundo', world_female_value, left=world_male_value, height=bar_height, color='#CDDC39', alpha=0.3, label='Mundo Mulheres')
+
+        # Adicionar rótulos de percentagem para o mundo
+        ax.text(world_male_value, len(data_year), f'{world_male_value:.2f}%', ha='right', va='center', color='#00E676', fontweight='bold')
+        ax.text(world_female_value, len(data_year), f'{world_female_value:.2f}%', ha='left', va='center', color='#CDDC39', fontweight='bold')
 
     # Adicionar um título e rótulos aos eixos
     ax.set_title(f'Prevalência de depressão em homens e mulheres para o ano {year}', weight='bold')
@@ -312,8 +2139,18 @@ def barras():
     
     # Exibir a legenda
     ax.legend()
-    
-    # Exibir o gráfico
+
+    return fig
+
+
+def barras():
+    import matplotlib.pyplot as plt
+
+    # Entrada para o ano
+    year = int(input('Ano: '))
+
+    # Criar e exibir o gráfico
+    figura_barras(year)
     plt.show()
     
     # Limpar a tela
@@ -327,38 +2164,142 @@ def barras():
 # %% [markdown]
 # D. Evolução das doenças mentais ao longo dos anos
 
+# %% [markdown]
+# As séries anuais de todas as entidades e métricas são guardadas num único array denso (entidade × métrica × ano), construído uma vez a partir da tabela de factos. As séries de vários países e métricas, alinhadas pelos mesmos anos, são uma seleção deste array, e as séries já montadas ficam numa cache LRU. Assim, sobrepor dezenas de países no gráfico de linhas não obriga a filtrar os dados uma vez por país.
+#
+# As marcas do eixo y de cada subgráfico são calculadas a partir dos valores representados (múltiplos de 1, 2 ou 5 × 10^k).
+
 # %%
-def linhas():
-    # Solicitar o país
-    country = input('Qual o país: ').capitalize()
-    selected_country = df_0[df_0['Entity'] == country]
+# Número máximo de conjuntos de séries guardados na cache
+CAPACIDADE_CACHE_SERIES = 64
+
+# Array denso com as séries de todas as entidades e séries já montadas, indexadas por (países, métricas)
+matriz_series = None
+cache_series = CacheLRU(CAPACIDADE_CACHE_SERIES)
+
+
+def obter_matriz_series():
+    global matriz_series
+    if matriz_series is None:
+        armazem = obter_armazem()
+        factos = armazem['factos']
+
+        # Cada entidade ocupa um bloco contíguo (métricas × anos), com NaN onde não há valores
+        anos = np.unique(factos['year'].to_numpy())
+        valores = np.full((len(armazem['entidades']), len(armazem['metricas']), len(anos)), np.nan)
+        valores[factos['entity_id'].to_numpy(), factos['metric_id'].to_numpy(),
+                np.searchsorted(anos, factos['year'].to_numpy())] = valores_float64(factos['value'])
+        matriz_series = {'anos': anos, 'valores': valores}
+    return matriz_series
+
+
+def series(paises, metricas):
+    # Anos e array (países × métricas × anos) com as séries pedidas; os países desconhecidos ficam a NaN.
+    # Os arrays devolvidos ficam na cache e não devem ser alterados
+    chave = (tuple(paises), tuple(metricas))
+    resultado = cache_series.obter(chave)
+    if resultado is None:
+        armazem = obter_armazem()
+        matriz = obter_matriz_series()
+        ids = np.array([armazem['id_entidade'].get(pais, -1) for pais in paises], dtype='int64')
+        ids_metricas = [armazem['id_metrica'][m] for m in metricas]
+
+        valores = np.full((len(paises), len(metricas), len(matriz['anos'])), np.nan)
+        valores[ids >= 0] = matriz['valores'][np.ix_(ids[ids >= 0], ids_metricas)]
+        resultado = (matriz['anos'], valores)
+        cache_series.guardar(chave, resultado)
+    return resultado
+
+
+def passo_eixo(minimo, maximo, intervalos=4):
+    # Distância entre marcas do eixo (1, 2 ou 5 × 10^k) para cerca de 'intervalos' intervalos entre o mínimo e o máximo
+    if not (np.isfinite(minimo) and np.isfinite(maximo)):
+        return None
+    amplitude = (maximo - minimo) or abs(maximo) or 1.0
+    bruto = amplitude / intervalos
+    potencia = 10.0 ** np.floor(np.log10(bruto))
+    for fator in (1, 2, 5, 10):
+        if bruto <= fator * potencia:
+            return float(fator * potencia)
 
-    # Ajustar o tamanho dos subplots
-    fig = sp.make_subplots(rows=selected_country.columns[5:11].shape[0], cols=1, subplot_titles=selected_country.columns[5:11],
-                           shared_xaxes=True, vertical_spacing=0.02)
 
-    # Adicionar linhas para cada subplot
-    for i, col in enumerate(selected_country.columns[5:11], start=1):
-        fig.add_trace(go.Scatter(x=selected_country["Year"], y=selected_country[col], mode='lines', name=col),
-                      row=i, col=1)
+# %%
+def modelo_linhas():
+    import plotly.subplots as sp
+    import plotly.graph_objects as go
 
-    # Atualizar layout
-    fig.update_layout(height=selected_country.columns[5:11].shape[0] * 200, title_text='Evolution of the main mental health issues over the years',
-                      showlegend=False)
+    if 'linhas' not in modelos:
+        # Métricas representadas: todas as da tabela df_0
+        colunas = obter_armazem()['metricas_tabela']['df_0']
 
-    # Definir dtick para cada gráfico
-    dtick_values = [0.001, 0.02, 0.01, 0.01, 0.1, 0.02]  # Precisa de ser otimizado
+        # Ajustar o tamanho dos subplots
+        fig = sp.make_subplots(rows=len(colunas), cols=1, subplot_titles=colunas,
+                               shared_xaxes=True, vertical_spacing=0.02)
 
-    for i in range(1, selected_country.columns[5:11].shape[0] + 1):
-        fig.update_yaxes(tickmode='linear', dtick=dtick_values[i-1], row=i, col=1, showgrid=False)
+        # Adicionar uma linha (ainda sem dados) para cada subplot, que indica os eixos de cada métrica
+        for i, col in enumerate(colunas, start=1):
+            fig.add_trace(go.Scatter(x=[], y=[], mode='lines', name=col), row=i, col=1)
 
-    # Atualizar eixos
-    fig.update_xaxes(dtick="M1", tickformat="%Y", ticklabelmode="period")
+        # Atualizar layout
+        fig.update_layout(height=len(colunas) * 200, title_text='Evolution of the main mental health issues over the years',
+                          showlegend=False)
+        fig.update_yaxes(tickmode='linear', showgrid=False)
 
-    # Mostrar o gráfico
-    fig.show()
+        # Atualizar eixos
+        fig.update_xaxes(dtick="M1", tickformat="%Y", ticklabelmode="period")
+
+        modelos['linhas'] = {'figura': fig, 'colunas': colunas}
+    return modelos['linhas']
+
+
+def construir_linhas(paises):
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
+    modelo = modelo_linhas()
+    colunas = modelo['colunas']
+    anos, valores = series(paises, colunas)
 
+    # Uma linha por país em cada subplot, com a mesma cor em todos os subplots e uma entrada na legenda por país
+    varios = len(paises) > 1
+    fig = go.Figure(layout=modelo['figura'].layout)
+    tracos = []
+    for j, (col, eixos) in enumerate(zip(colunas, modelo['figura'].data)):
+        for i, pais in enumerate(paises):
+            tracos.append(go.Scatter(x=anos, y=valores[i, j], mode='lines', name=pais if varios else col,
+                                     legendgroup=pais, showlegend=varios and j == 0,
+                                     line_color=qualitative.Plotly[i % len(qualitative.Plotly)],
+                                     xaxis=eixos.xaxis, yaxis=eixos.yaxis))
+    fig.add_traces(tracos)
 
+    # Marcas do eixo y de cada métrica a partir dos valores representados (eixo 'y2' -> 'yaxis2' no layout)
+    for j, eixos in enumerate(modelo['figura'].data):
+        if not np.isnan(valores[:, j]).all():
+            fig.layout['yaxis' + eixos.yaxis[1:]].dtick = passo_eixo(np.nanmin(valores[:, j]), np.nanmax(valores[:, j]))
+    fig.update_layout(showlegend=varios)
+
+    return fig
+
+
+def figura_linhas(paises):
+    # Um país (texto) ou vários (lista)
+    if isinstance(paises, str):
+        paises = [paises]
+    return figura_em_cache('linhas', tuple(paises), construir_linhas)
+
+
+def linhas():
+    # Solicitar um ou mais países, separados por vírgulas; os nomes não reconhecidos são indicados com sugestões
+    paises = []
+    for nome, pais, sugestoes in resolver_paises(input('Qual o país (ou vários, separados por vírgulas): ')):
+        if pais is not None:
+            paises.append(pais)
+        else:
+            print(f"País não encontrado: {nome}" + (f" (sugestões: {', '.join(sugestoes)})" if sugestoes else ''))
+
+    # Mostrar o gráfico
+    if paises:
+        figura_linhas(paises).show()
 # %% [markdown]
 # ##### 2.3.2. Tabelas
 
@@ -366,15 +2307,25 @@ def linhas():
 # A. Função para obter as tabelas dos dataframes
 
 # %%
-def tabela(df):
-    # Solicitar o país
-    country = input('Qual o país: ').capitalize()
+def dados_tabela(nome, country):
+    # Linhas de um país com as métricas da tabela limpa 'nome' (df_0 a df_3)
+    with medir('consulta', tabela=nome) as etapa:
+        resultado = consultar(entidades=[country], pivot=True, tabela=nome)
+        etapa['linhas'] = len(resultado)
+    return resultado
+
+
+def tabela(nome):
+    # Solicitar o país (aceitando nomes e códigos ISO, sem distinguir maiúsculas, ou uma das sugestões)
+    country = pedir_pais()
+    if country is None:
+        return True
     
     # Imprimir o nome do país
     print("=" * len(country), country, "=" * len(country), sep="\n")
     
     # Imprimir a tabela usando o tabulate
-    print(tabulate(df[df['Entity'] == country], headers='keys', tablefmt='fancy_grid'))
+    print(tabulate(dados_tabela(nome, country), headers='keys', tablefmt='fancy_grid'))
     
     # Aguardar que o utilizador pressione de Enter para continuar
     input("Pressione Enter para continuar...")
@@ -389,15 +2340,17 @@ def tabela(df):
 # B. Função para obter as tabelas estatísticas
 
 # %%
-def tabela_describe(df):
-    # Solicitar o país
-    country = input('Qual o país: ').capitalize()
+def tabela_describe(nome):
+    # Solicitar o país (aceitando nomes e códigos ISO, sem distinguir maiúsculas, ou uma das sugestões)
+    country = pedir_pais()
+    if country is None:
+        return True
     
     # Imprimir o nome do país
     print("=" * len(country), country, "=" * len(country), sep="\n")
     
     # Imprimir a tabela usando o tabulate
-    print(tabulate(df[df['Entity'] == country].describe(), headers='keys', tablefmt='fancy_grid'))
+    print(tabulate(resumo(nome, country), headers='keys', tablefmt='fancy_grid'))
     
     # Aguardar que o utilizador pressione de Enter para continuar
     input("Pressione Enter para continuar...")
@@ -408,6 +2361,549 @@ def tabela_describe(df):
     # Retornar True para indicar que a tabela foi chamada
     return True
 
+# %% [markdown]
+# C. Função para obter a correlação entre a taxa de depressão e a taxa de suicídio
+
+# %%
+def tabela_correlacoes():
+    # Solicitar o país (opcional)
+    country = pedir_pais('Qual o país (Enter para nenhum): ')
+
+    # Correlação no mundo, em cada continente e no país, com a tendência anual de cada uma das taxas
+    x, y = PAR_DEPRESSAO_SUICIDIO
+    linhas = []
+    for nivel, chaves in (('World', None), ('Continent', None), ('Entity', [country] if country else [])):
+        correlacao = correlacoes(x, y, nivel, chaves).rename(columns={nivel: 'Local'})
+        for metrica, coluna in ((x, 'Tendência depressão (%/ano)'), (y, 'Tendência suicídio (%/ano)')):
+            tendencia = tendencias(metrica, nivel, chaves).rename(columns={nivel: 'Local', 'slope_pct': coluna})
+            correlacao = correlacao.merge(tendencia[['Local', coluna]], on='Local', how='left')
+        linhas.append(correlacao)
+    tabela = pd.concat(linhas, ignore_index=True).drop(columns=['x', 'y'])
+
+    # Imprimir a tabela usando o tabulate
+    titulo = 'Taxa de depressão vs. taxa de suicídio'
+    print("=" * len(titulo), titulo, "=" * len(titulo), sep="\n")
+    print(tabulate(tabela, headers='keys', tablefmt='fancy_grid', showindex=False))
+
+    # Aguardar que o utilizador pressione de Enter para continuar
+    input("Pressione Enter para continuar...")
+
+    # Limpar a tela após pressionar Enter
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+    # Retornar True para indicar que a tabela foi chamada
+    return True
+
+# %% [markdown]
+# ##### 2.3.3. Exportação dos gráficos em lote
+
+# %% [markdown]
+# Para gerar relatórios sem intervenção do utilizador (por exemplo, numa tarefa noturna), os gráficos podem ser exportados em lote para ficheiros PNG, SVG ou HTML, para listas de anos (mapa, bolhas, bolhas_regioes e barras) e de países (linhas, com os nomes resolvidos como no menu; um país não reconhecido interrompe a exportação). Os gráficos são distribuídos por um conjunto de processos e, no fim, é apresentado o débito (gráficos por segundo) e a latência de cada gráfico.
+#
+# A exportação dos gráficos Plotly para PNG/SVG requer o pacote `kaleido`; sem ele, a exportação termina com um erro antes de escrever qualquer ficheiro.
+
+# %%
+# Funções que constroem cada tipo de gráfico e o parâmetro de que dependem
+GRAFICOS = {
+    'mapa': (figura_mapa, 'anos'),
+    'bolhas': (figura_bolhas, 'anos'),
+    'bolhas_regioes': (figura_bolhas_regioes, 'anos'),
+    'barras': (figura_barras, 'anos'),
+    'linhas': (figura_linhas, 'paises'),
+}
+
+FORMATOS = ['png', 'svg', 'html']
+
+
+# %%
+def nome_ficheiro(tipo, parametro, formato):
+    # Nome do ficheiro exportado, ex.: 'barras_2000.png', 'linhas_United_Kingdom.html' ou 'mapa.html' (animado)
+    if parametro is None:
+        return f'{tipo}.{formato}'
+    return f'{tipo}_{str(parametro).replace(" ", "_")}.{formato}'
+
+
+def exportar_grafico(tipo, parametro, formatos, destino):
+    import matplotlib.pyplot as plt
+
+    inicio = time.perf_counter()
+
+    # Construir a figura uma única vez e guardá-la em todos os formatos pedidos
+    fig = GRAFICOS[tipo][0](parametro) if parametro is not None else GRAFICOS[tipo][0]()
+    ficheiros = []
+    for formato in formatos:
+        caminho = os.path.join(destino, nome_ficheiro(tipo, parametro, formato))
+
+        # As figuras do matplotlib (barras) não têm exportação para HTML, pelo que o SVG é incluído numa página HTML
+        if isinstance(fig, plt.Figure):
+            if formato == 'html':
+                buffer = io.StringIO()
+                fig.savefig(buffer, format='svg', bbox_inches='tight')
+                with open(caminho, 'w') as f:
+                    f.write(f'<!DOCTYPE html>\n<html><body>\n{buffer.getvalue()}\n</body></html>\n')
+            else:
+                fig.savefig(caminho, format=formato, bbox_inches='tight')
+        elif formato == 'html':
+            # O plotly.js é guardado uma única vez na pasta de destino em vez de ser incluído em cada ficheiro
+            fig.write_html(caminho, include_plotlyjs='directory')
+        else:
+            fig.write_image(caminho, format=formato)
+        ficheiros.append(caminho)
+
+    if isinstance(fig, plt.Figure):
+        plt.close(fig)
+
+    return {'grafico': tipo, 'parametro': parametro, 'ficheiros': ficheiros, 'latencia': time.perf_counter() - inicio}
+
+
+# %%
+def exportar_graficos(graficos, anos=(), paises=(), formatos=('html',), destino='relatorios', processos=None):
+    import matplotlib.pyplot as plt
+
+    # Os gráficos Plotly (todos exceto as barras) só são exportados para PNG/SVG com o kaleido: verificar antes de
+    # escrever qualquer ficheiro, em vez de falhar nos processos a meio da exportação
+    imagens = [formato for formato in formatos if formato != 'html']
+    if imagens and any(tipo != 'barras' for tipo in graficos) and importlib.util.find_spec('kaleido') is None:
+        raise RuntimeError(f"A exportação dos gráficos Plotly para {'/'.join(imagens).upper()} requer o pacote kaleido "
+                           f"(pip install kaleido)")
+
+    # Resolver os países como no menu (nomes ou códigos ISO, sem distinguir maiúsculas); um país não reconhecido
+    # interrompe a exportação antes de escrever qualquer ficheiro, em vez de exportar gráficos sem dados
+    resolvidos = [(nome, *resolver_pais(nome)) for nome in paises]
+    desconhecidos = [f"{nome}" + (f" (sugestões: {', '.join(sugestoes)})" if sugestoes else '')
+                     for nome, pais, sugestoes in resolvidos if pais is None]
+    if desconhecidos:
+        raise ValueError(f"Países não encontrados: {'; '.join(desconhecidos)}")
+    paises = list(dict.fromkeys(pais for _, pais, _ in resolvidos))
+
+    os.makedirs(destino, exist_ok=True)
+
+    # Em modo não interativo, o matplotlib desenha sem janela
+    plt.switch_backend('Agg')
+
+    # Carregar os dados antes de criar os processos, para que estes os herdem já carregados
+    obter_armazem()
+
+    # Lista de gráficos a gerar: um por ano ou por país; o mapa e as bolhas sem anos são exportados animados
+    tarefas = []
+    for tipo in graficos:
+        parametros = list(anos) if GRAFICOS[tipo][1] == 'anos' else list(paises)
+        if not parametros and tipo in ('mapa', 'bolhas', 'bolhas_regioes'):
+            parametros = [None]
+        tarefas += [(tipo, parametro) for parametro in parametros]
+
+    # Distribuir os gráficos por um conjunto de processos
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        futuros = [executor.submit(exportar_grafico, tipo, parametro, list(formatos), destino) for tipo, parametro in tarefas]
+        resultados = [futuro.result() for futuro in futuros]
+    duracao = time.perf_counter() - inicio
+
+    return {'resultados': resultados, 'duracao': duracao, 'debito': len(resultados) / duracao if duracao else 0.0}
+
+
+# %%
+def imprimir_relatorio_exportacao(relatorio):
+    resultados = relatorio['resultados']
+    latencias = np.array([r['latencia'] for r in resultados])
+
+    # Tabela com a latência de cada gráfico
+    linhas_tabela = [(r['grafico'], r['parametro'], len(r['ficheiros']), f"{r['latencia'] * 1000:.0f}") for r in resultados]
+    print(tabulate(linhas_tabela, headers=['Gráfico', 'Parâmetro', 'Ficheiros', 'Latência (ms)'], tablefmt='fancy_grid'))
+
+    # Resumo: débito e distribuição das latências
+    if len(latencias):
+        print(f"{len(resultados)} gráficos em {relatorio['duracao']:.2f} s: {relatorio['debito']:.2f} gráficos/s")
+        print(f"Latência (ms): média {latencias.mean() * 1000:.0f}, p50 {np.percentile(latencias, 50) * 1000:.0f}, "
+              f"p95 {np.percentile(latencias, 95) * 1000:.0f}, máx. {latencias.max() * 1000:.0f}")
+
+
+# %% [markdown]
+# ##### Animação do mapa por fotogramas
+#
+# Para exportar a animação do mapa como GIF ou sequência de imagens, cada ano é desenhado como uma imagem PNG independente (um fotograma), num conjunto de processos. Os fotogramas ficam guardados em `data/cache/fotogramas`, numa pasta por estilo de desenho (tamanho e escala; a duração de cada fotograma só é usada ao montar o GIF e não obriga a redesenhá-los), com o nome formado pelo ano e por um hash dos dados desse ano e dos limites da escala de cores. Numa nova exportação só são desenhados os anos cujos dados (ou o estilo) mudaram; os restantes são lidos da cache. No fim, os fotogramas são juntos num GIF (com o `Pillow`) ou copiados para uma pasta como sequência de imagens.
+#
+# Tal como a exportação em PNG, o desenho dos fotogramas requer o pacote `kaleido`.
+
+# %%
+# Pasta dos fotogramas desenhados e estilo por omissão (tamanho em píxeis, escala e duração de cada fotograma no GIF)
+FOTOGRAMAS_DIR = 'data/cache/fotogramas'
+ESTILO_MAPA = {'largura': 1200, 'altura': 700, 'escala': 1, 'duracao_ms': 400}
+
+
+def hash_estilo(estilo):
+    # Os fotogramas dependem do estilo de desenho (sem a duração, usada apenas no GIF) e da versão do plotly usada
+    # para os desenhar
+    import plotly
+
+    desenho = {chave: valor for chave, valor in estilo.items() if chave != 'duracao_ms'}
+    return hashlib.sha256(json.dumps([desenho, plotly.__version__], sort_keys=True).encode()).hexdigest()[:16]
+
+
+def hashes_fotogramas(anos):
+    # Hash dos dados de cada ano (códigos, valores e nomes) e dos limites da escala de cores, comuns a todos os anos
+    modelo = modelo_mapa()
+    data = modelo['data']
+    coloraxis = modelo['figura'].layout.coloraxis
+    limites = np.array([coloraxis.cmin, coloraxis.cmax], dtype='float64').tobytes()
+
+    hashes = {}
+    for ano in anos:
+        linhas = data[data['Year'] == ano][['Code', 'Entity', 'Depression (%)']]
+        h = hashlib.sha256(limites)
+        h.update(pd.util.hash_pandas_object(linhas, index=False).to_numpy().tobytes())
+        hashes[ano] = h.hexdigest()[:16]
+    return hashes
+
+
+def desenhar_fotograma(ano, caminho, estilo):
+    inicio = time.perf_counter()
+
+    # Escrever num ficheiro temporário e só depois mudar o nome, para que um desenho interrompido não fique na cache
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    figura_mapa(ano).write_image(temporario, format='png', width=estilo['largura'], height=estilo['altura'],
+                                 scale=estilo['escala'])
+    os.replace(temporario, caminho)
+
+    return {'ano': ano, 'latencia': time.perf_counter() - inicio}
+
+
+def desenhar_fotogramas(anos=None, estilo=None, processos=None):
+    # Devolver o caminho do fotograma de cada ano, desenhando apenas os que não estão na cache
+    estilo = {**ESTILO_MAPA, **(estilo or {})}
+    pasta = os.path.join(FOTOGRAMAS_DIR, hash_estilo(estilo))
+    os.makedirs(pasta, exist_ok=True)
+
+    # Carregar os dados antes de criar os processos, para que estes os herdem já carregados
+    data = modelo_mapa()['data']
+    anos = sorted(anos) if anos else sorted(data['Year'].unique().tolist())
+    caminhos = {ano: os.path.join(pasta, f'{ano}_{h}.png') for ano, h in hashes_fotogramas(anos).items()}
+    em_falta = [ano for ano, caminho in caminhos.items() if not os.path.exists(caminho)]
+
+    resultados = []
+    if em_falta:
+        if importlib.util.find_spec('kaleido') is None:
+            raise RuntimeError('O desenho dos fotogramas do mapa requer o pacote kaleido (pip install kaleido)')
+
+        # Desenhar os fotogramas em falta num conjunto de processos
+        with medir('fotogramas', linhas=len(em_falta)):
+            with ProcessPoolExecutor(max_workers=processos) as executor:
+                futuros = [executor.submit(desenhar_fotograma, ano, caminhos[ano], estilo) for ano in em_falta]
+                resultados = [futuro.result() for futuro in futuros]
+
+        # Apagar os fotogramas antigos dos anos redesenhados (com dados que entretanto mudaram)
+        for ano in em_falta:
+            for ficheiro in os.listdir(pasta):
+                if ficheiro.startswith(f'{ano}_') and os.path.join(pasta, ficheiro) != caminhos[ano]:
+                    os.remove(os.path.join(pasta, ficheiro))
+    contar('fotogramas.cache', len(caminhos) - len(em_falta))
+
+    return {'caminhos': caminhos, 'estilo': estilo, 'resultados': resultados}
+
+
+def animar_mapa(anos=None, formato='gif', destino='relatorios', estilo=None, processos=None):
+    import shutil
+
+    inicio = time.perf_counter()
+    fotogramas = desenhar_fotogramas(anos, estilo, processos)
+    caminhos = fotogramas['caminhos']
+    os.makedirs(destino, exist_ok=True)
+
+    with medir('animacao', linhas=len(caminhos)):
+        if formato == 'gif':
+            from PIL import Image
+
+            # Juntar os fotogramas num GIF que se repete indefinidamente
+            ficheiro = os.path.join(destino, 'mapa.gif')
+            imagens = [Image.open(caminhos[ano]) for ano in sorted(caminhos)]
+            imagens[0].save(ficheiro, save_all=True, append_images=imagens[1:], loop=0,
+                            duration=fotogramas['estilo']['duracao_ms'])
+            for imagem in imagens:
+                imagem.close()
+        else:
+            # Sequência de imagens: uma por ano, numa pasta própria
+            ficheiro = os.path.join(destino, 'mapa_fotogramas')
+            os.makedirs(ficheiro, exist_ok=True)
+            for ano, caminho in caminhos.items():
+                shutil.copyfile(caminho, os.path.join(ficheiro, f'mapa_{ano}.png'))
+
+    return {'ficheiro': ficheiro, 'fotogramas': len(caminhos), 'desenhados': fotogramas['resultados'],
+            'duracao': time.perf_counter() - inicio}
+
+
+def imprimir_relatorio_animacao(relatorio):
+    desenhados = relatorio['desenhados']
+    print(f"{relatorio['ficheiro']}: {relatorio['fotogramas']} fotogramas ({len(desenhados)} desenhados, "
+          f"{relatorio['fotogramas'] - len(desenhados)} da cache) em {relatorio['duracao']:.2f} s")
+    if desenhados:
+        latencias = np.array([r['latencia'] for r in desenhados])
+        print(f"Latência por fotograma (ms): média {latencias.mean() * 1000:.0f}, máx. {latencias.max() * 1000:.0f}")
+
+
+# %% [markdown]
+# ##### 2.3.4. Serviço HTTP/JSON
+
+# %% [markdown]
+# As mesmas vistas do menu podem ser consultadas por outros programas (por exemplo, dashboards) através de um pequeno serviço HTTP local que devolve JSON. O serviço usa apenas `asyncio` e aceita pedidos GET:
+#
+# | Caminho | Parâmetros | Conteúdo |
+# |---|---|---|
+# | `/tabela` | `nome` (df_0 a df_3), `pais` | linhas do país, como em `tabela` |
+# | `/describe` | `nome` e `pais`, `continente` ou `ano` | estatísticas `describe()`, como em `tabela_describe` |
+# | `/top` | `ano` (todos por omissão), `n` (20), `criterio` (prevalência média ou uma métrica) | países com maior prevalência média de depressão, como em `barras` |
+# | `/regioes` | `nivel` (`region` por omissão), `ano` (todos por omissão) | agregados regionais ponderados pela população |
+# | `/series` | `pais` e `metrica` (um ou mais de cada) | evolução anual das métricas, como em `linhas` |
+# | `/correlacoes` | `x` e `y` (taxa de depressão e taxa de suicídio por omissão, `todas` para todas), `nivel` (`Entity`, `Continent` ou `World`), `pais` ou `continente` | correlações e retas de regressão |
+# | `/tendencias` | `metrica`, `nivel`, `pais` ou `continente` | tendência anual de uma métrica |
+#
+# ```
+# python Projeto.py servir --porta 8000
+# curl 'http://127.0.0.1:8000/top?ano=2017&n=5'
+# ```
+#
+# As respostas já codificadas ficam numa cache LRU com validade, indexada pelo caminho e pelos parâmetros. As consultas demoram poucos milissegundos e correm no próprio ciclo de eventos. Um erro inesperado numa vista é devolvido como uma resposta 500 em JSON (e o traceback escrito no stderr do serviço), sem fechar a ligação; estas respostas não ficam na cache. O `asyncio` só é importado quando o serviço arranca.
+
+# %%
+# Número máximo de respostas guardadas na cache e validade de cada resposta (segundos)
+CAPACIDADE_CACHE_RESPOSTAS = 1024
+VALIDADE_CACHE_RESPOSTAS = 300
+
+cache_respostas = CacheLRU(CAPACIDADE_CACHE_RESPOSTAS, VALIDADE_CACHE_RESPOSTAS)
+
+# Frases de estado HTTP usadas nas respostas
+MOTIVOS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ErroPedido(Exception):
+    # Erro num pedido ao serviço, com o código de estado HTTP a devolver
+
+    def __init__(self, estado, mensagem, sugestoes=None):
+        super().__init__(mensagem)
+        self.estado = estado
+        self.sugestoes = sugestoes
+
+
+# %%
+def para_json(dados, orient):
+    # Converter um DataFrame ou Series em objetos Python serializáveis (os NaN passam a null)
+    return json.loads(dados.to_json(orient=orient, double_precision=15))
+
+
+def parametro(params, nome, tipo=str, omissao=None):
+    # Valor de um parâmetro do pedido, convertido para o tipo indicado
+    if nome not in params:
+        if omissao is None:
+            raise ErroPedido(400, f"Falta o parâmetro '{nome}'")
+        return omissao
+    try:
+        return tipo(params[nome][-1])
+    except ValueError:
+        raise ErroPedido(400, f"Parâmetro '{nome}' inválido: {params[nome][-1]}")
+
+
+def parametro_pais(params):
+    # Nome ou código do país, resolvido como no menu; sem correspondência, o erro inclui as sugestões
+    pais, sugestoes = resolver_pais(parametro(params, 'pais'))
+    if pais is None:
+        raise ErroPedido(404, f"País não encontrado: {params['pais'][-1]}", sugestoes)
+    return pais
+
+
+def parametro_tabela(params):
+    nome = parametro(params, 'nome')
+    if nome not in obter_armazem()['metricas_tabela']:
+        raise ErroPedido(404, f'Tabela não encontrada: {nome}')
+    return nome
+
+
+# %%
+def vista_tabela(params):
+    nome, pais = parametro_tabela(params), parametro_pais(params)
+    return {'tabela': nome, 'pais': pais, 'linhas': para_json(dados_tabela(nome, pais), 'records')}
+
+
+def vista_describe(params):
+    nome = parametro_tabela(params)
+
+    # Estatísticas de um país, de um continente ou de um ano (todos os países)
+    if 'continente' in params:
+        nivel, campo, chave = 'Continent', 'continente', parametro(params, 'continente')
+    elif 'ano' in params:
+        nivel, campo, chave = 'Year', 'ano', parametro(params, 'ano', int)
+    else:
+        nivel, campo, chave = 'Entity', 'pais', parametro_pais(params)
+
+    estatisticas = resumo(nome, chave, nivel)
+    if estatisticas.empty:
+        raise ErroPedido(404, f'Sem dados para {campo} {chave}')
+    return {'tabela': nome, campo: chave, 'estatisticas': para_json(estatisticas, 'index')}
+
+
+def vista_top(params):
+    n, criterio = parametro(params, 'n', int, 20), parametro(params, 'criterio', str, MEDIA_PREVALENCIA)
+    if n < 1:
+        raise ErroPedido(400, f"Parâmetro 'n' inválido: {n}")
+    if criterio != MEDIA_PREVALENCIA and criterio not in obter_armazem()['id_metrica']:
+        raise ErroPedido(404, f'Métrica não encontrada: {criterio}')
+
+    # Sem ano, o top N de todos os anos
+    if 'ano' not in params:
+        return {'criterio': criterio, 'top': para_json(top_n_todos_anos(n, criterio), 'records')}
+
+    ano = parametro(params, 'ano', int)
+    if ano not in classificacao(criterio)['anos']:
+        raise ErroPedido(404, f'Sem dados para o ano {ano}')
+    metricas = PREVALENCIAS if criterio == MEDIA_PREVALENCIA else [criterio]
+    mundo = consultar(metricas=metricas, entidades=['World'], anos=ano, pivot=True)
+    return {'criterio': criterio, 'ano': ano, 'top': para_json(top_n(ano, n, criterio), 'records'),
+            'mundo': para_json(mundo, 'records')}
+
+
+def parametro_nivel_analise(params):
+    # Nível das correlações e tendências e chaves (pais ou continente, repetidos) a filtrar
+    nivel = parametro(params, 'nivel', str, 'Continent')
+    if nivel not in NIVEIS_ANALISE:
+        raise ErroPedido(404, f'Nível não encontrado: {nivel}')
+    if 'pais' in params:
+        return nivel, [parametro_pais({'pais': [pais]}) for pais in params['pais']]
+    return nivel, params.get('continente')
+
+
+def parametro_metrica(params, nome, omissao):
+    metrica = parametro(params, nome, str, omissao)
+    if metrica is not None and metrica not in obter_armazem()['id_metrica']:
+        raise ErroPedido(404, f'Métrica não encontrada: {metrica}')
+    return metrica
+
+
+def vista_correlacoes(params):
+    # Por omissão, o par da questão 4; 'x=todas' ou 'y=todas' devolve todas as métricas desse eixo
+    nivel, chaves = parametro_nivel_analise(params)
+    x, y = (None if params.get(eixo) == ['todas'] else parametro_metrica(params, eixo, omissao)
+            for eixo, omissao in zip('xy', PAR_DEPRESSAO_SUICIDIO))
+    return {'nivel': nivel, 'x': x, 'y': y, 'linhas': para_json(correlacoes(x, y, nivel, chaves), 'records')}
+
+
+def vista_tendencias(params):
+    nivel, chaves = parametro_nivel_analise(params)
+    metrica = parametro_metrica(params, 'metrica', PAR_DEPRESSAO_SUICIDIO[0])
+    return {'nivel': nivel, 'metrica': metrica, 'linhas': para_json(tendencias(metrica, nivel, chaves), 'records')}
+
+
+def vista_regioes(params):
+    nivel = parametro(params, 'nivel', str, 'region')
+    if nivel not in NIVEIS_REGIOES:
+        raise ErroPedido(404, f'Nível não encontrado: {nivel}')
+    anos = parametro(params, 'ano', int) if 'ano' in params else None
+    return {'nivel': nivel, 'ano': anos, 'linhas': para_json(consultar_cubo(nivel, anos=anos, pivot=True), 'records')}
+
+
+def vista_series(params):
+    # Um ou mais países e métricas (por omissão, as do gráfico de linhas), com parâmetros repetidos
+    if 'pais' not in params:
+        raise ErroPedido(400, "Falta o parâmetro 'pais'")
+    paises = [parametro_pais({'pais': [pais]}) for pais in params['pais']]
+    metricas = params.get('metrica', obter_armazem()['metricas_tabela']['df_0'])
+    for metrica in metricas:
+        if metrica not in obter_armazem()['id_metrica']:
+            raise ErroPedido(404, f'Métrica não encontrada: {metrica}')
+
+    anos, valores = series(paises, metricas)
+    valores = np.where(np.isnan(valores), None, valores)
+    return {'anos': anos.tolist(),
+            'series': {pais: {m: valores[i, j].tolist() for j, m in enumerate(metricas)} for i, pais in enumerate(paises)}}
+
+
+# Função que responde a cada caminho do serviço
+VISTAS = {
+    '/tabela': vista_tabela,
+    '/describe': vista_describe,
+    '/top': vista_top,
+    '/regioes': vista_regioes,
+    '/correlacoes': vista_correlacoes,
+    '/tendencias': vista_tendencias,
+    '/series': vista_series,
+}
+
+
+def responder(alvo):
+    # Estado HTTP e corpo JSON da resposta a um pedido, ex.: '/top?ano=2017&n=5'
+    url = urlsplit(alvo)
+    params = parse_qs(url.query)
+    chave = (url.path, tuple(sorted((nome, tuple(valores)) for nome, valores in params.items())))
+
+    resposta = cache_respostas.obter(chave)
+    if resposta is None:
+        try:
+            if url.path not in VISTAS:
+                raise ErroPedido(404, f'Caminho desconhecido: {url.path}')
+            resposta = (200, json.dumps(VISTAS[url.path](params)).encode())
+        except ErroPedido as erro:
+            corpo = {'erro': str(erro)} if erro.sugestoes is None else {'erro': str(erro), 'sugestoes': erro.sugestoes}
+            resposta = (erro.estado, json.dumps(corpo).encode())
+        except Exception as erro:
+            # Erro inesperado numa vista: responder 500 (sem guardar na cache) em vez de fechar a ligação sem resposta
+            traceback.print_exc()
+            return 500, json.dumps({'erro': f'Erro interno: {type(erro).__name__}: {erro}'}).encode()
+        cache_respostas.guardar(chave, resposta)
+    return resposta
+
+
+# %%
+async def atender_ligacao(leitor, escritor):
+    # Atender os pedidos de uma ligação (HTTP/1.1, que a mantém aberta por omissão) até o cliente a fechar
+    try:
+        while True:
+            linha = await leitor.readline()
+            if not linha.strip():
+                break
+            metodo, alvo, versao = linha.decode('latin-1').split()
+
+            # Dos cabeçalhos só interessa saber se a ligação deve ser fechada no fim da resposta
+            fechar = versao == 'HTTP/1.0'
+            while (cabecalho := await leitor.readline()).strip():
+                nome, _, valor = cabecalho.decode('latin-1').partition(':')
+                if nome.strip().lower() == 'connection':
+                    fechar = valor.strip().lower() != 'keep-alive'
+
+            if metodo == 'GET':
+                estado, corpo = responder(alvo)
+            else:
+                estado, corpo = 405, json.dumps({'erro': f'Método não suportado: {metodo}'}).encode()
+
+            escritor.write(f'HTTP/1.1 {estado} {MOTIVOS[estado]}\r\n'
+                           f'Content-Type: application/json; charset=utf-8\r\n'
+                           f'Content-Length: {len(corpo)}\r\n'
+                           f'Connection: {"close" if fechar else "keep-alive"}\r\n\r\n'.encode() + corpo)
+            await escritor.drain()
+            if fechar:
+                break
+    except (ConnectionError, ValueError):
+        # Ligação interrompida pelo cliente ou linha de pedido mal formada
+        pass
+    finally:
+        escritor.close()
+
+
+def servir(anfitriao='127.0.0.1', porta=8000):
+    # O asyncio só é usado pelo serviço, pelo que não é importado no arranque do programa
+    import asyncio
+
+    # Carregar os dados antes de aceitar pedidos, para que o primeiro pedido não espere pelo carregamento
+    obter_armazem()
+
+    async def aceitar_ligacoes():
+        servidor = await asyncio.start_server(atender_ligacao, anfitriao, porta)
+        print(f'A servir em http://{anfitriao}:{porta} (Ctrl+C para terminar)', flush=True)
+        async with servidor:
+            await servidor.serve_forever()
+
+    try:
+        asyncio.run(aceitar_ligacoes())
+    except KeyboardInterrupt:
+        pass
+
+
 # %% [markdown]
 # #### 2.4. Configuração do menu e função principal
 
@@ -419,6 +2915,13 @@ def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 # %%
+def nome_acao(funcao):
+    # Nome de uma ação do menu nas medições, com os argumentos fixados (ex.: 'tabela(df_0)')
+    if isinstance(funcao, partial):
+        return f"{funcao.func.__name__}({', '.join(map(str, funcao.args))})"
+    return funcao.__name__
+
+
 def menu(titulo, opcoes):
     clear_flag = True  # Flag inicial para limpar a tela
 
@@ -444,7 +2947,9 @@ def menu(titulo, opcoes):
                     break
                 if int(op) <= len(opcoes):
                     # Chama a função associada à opção escolhida
-                    clear_flag = opcoes[int(op) - 1][1]()
+                    funcao = opcoes[int(op) - 1][1]
+                    with medir(f'menu.{nome_acao(funcao)}'):
+                        clear_flag = funcao()
                     continue
 
         # Mensagem de erro para entrada inválida
@@ -463,6 +2968,7 @@ def graficos():
     opcoes = [
         ("Mapa do mundo com estatísticas para a depressão ao longo do tempo", mapa),
         ("Gráfico da relação da Taxa de Depressão com a Taxa de Suicídio no mundo", bolhas),
+        ("Gráfico da relação da Taxa de Depressão com a Taxa de Suicídio por sub-região", bolhas_regioes),
         ("Gráfico de barras com a prevalência de depressão em homens e mulheres", barras),
         ("Gráfico de linhas com a evolução dos principais problemas de saúde mental ao longo dos anos", linhas)
     ]
@@ -478,14 +2984,15 @@ def graficos():
 def tabelas():
     # Lista de opções para o menu de tabelas, cada opção é um tuplo contendo o nome da tabela e a função associada
     opcoes = [
-        ("DF0: Tabela Saúde Mental", partial(tabela, df_0)),
-        ("DF1: Depressão em Homens e Mulheres (%)", partial(tabela, df_1)),
-        ("DF2: Suicídio e Depressão na População", partial(tabela, df_2)),
-        ("DF3: Depressão na População", partial(tabela, df_3)),
-        ("Estatísticas: Tabela Saúde Mental", partial(tabela_describe, df_0)),
-        ("Estatísticas: Depressão em Homens e Mulheres (%)", partial(tabela_describe, df_1)),
-        ("Estatísticas: Suicídio e Depressão na População", partial(tabela_describe, df_2)),
-        ("Estatísticas: Depressão na População", partial(tabela_describe, df_3))
+        ("DF0: Tabela Saúde Mental", partial(tabela, 'df_0')),
+        ("DF1: Depressão em Homens e Mulheres (%)", partial(tabela, 'df_1')),
+        ("DF2: Suicídio e Depressão na População", partial(tabela, 'df_2')),
+        ("DF3: Depressão na População", partial(tabela, 'df_3')),
+        ("Estatísticas: Tabela Saúde Mental", partial(tabela_describe, 'df_0')),
+        ("Estatísticas: Depressão em Homens e Mulheres (%)", partial(tabela_describe, 'df_1')),
+        ("Estatísticas: Suicídio e Depressão na População", partial(tabela_describe, 'df_2')),
+        ("Estatísticas: Depressão na População", partial(tabela_describe, 'df_3')),
+        ("Correlação: Depressão e Suicídio", tabela_correlacoes)
     ]
     
     # Chama a função do menu e passa o título 'Tabelas' e a lista de opções
@@ -506,8 +3013,123 @@ def main():
     # Chama a função do menu principal e passa o título 'Tendências globais em matéria de saúde mental' e a lista de opções
     return menu('Tendências globais em matéria de saúde mental', opcoes)
 
-# Inicia a execução do programa chamando a função main()
-main()
+# %% [markdown]
+# ##### 2.4.5. Linha de comandos
+
+# %% [markdown]
+# Sem argumentos, o programa abre o menu interativo. O comando `exportar` gera os gráficos em lote sem pedir dados ao utilizador, por exemplo:
+#
+# ```
+# python Projeto.py exportar --graficos barras linhas --anos 2000 2017 --paises Portugal Spain --formatos png html --destino relatorios --processos 4
+# ```
+#
+# O comando `animar` exporta a animação do mapa como GIF (ou, com `--formato png`, como sequência de imagens), desenhando apenas os fotogramas que não estão na cache:
+#
+# ```
+# python Projeto.py animar --anos 2000 2017 --formato gif --largura 1200 --altura 700 --processos 4
+# ```
+#
+# O comando `validar` limpa os dados (se mudaram desde a última execução) e apresenta o relatório de validação da última limpeza. Em todos os comandos, um erro de validação (também o de dados já aceites no menu interativo) interrompe a execução, que termina com o estado 1; o `validar` termina também com o estado 1 sempre que o relatório contém um erro.
+#
+# O comando `memoria` apresenta a memória das tabelas lidas dos CSV e no modo compacto (secção 2.2.7).
+#
+# O comando `servir` inicia o serviço HTTP/JSON da secção 2.3.4:
+#
+# ```
+# python Projeto.py servir --porta 8000 --validade 300
+# ```
+
+# %%
+def argumentos():
+    parser = argparse.ArgumentParser(description='Tendências globais em matéria de saúde mental')
+    comandos = parser.add_subparsers(dest='comando')
+
+    # Exportação dos gráficos em lote
+    exportar = comandos.add_parser('exportar', help='exportar gráficos para ficheiros sem o menu interativo')
+    exportar.add_argument('--graficos', nargs='+', choices=list(GRAFICOS), default=list(GRAFICOS))
+    exportar.add_argument('--anos', nargs='*', type=int, default=[])
+    exportar.add_argument('--paises', nargs='*', default=[])
+    exportar.add_argument('--formatos', nargs='+', choices=FORMATOS, default=['html'])
+    exportar.add_argument('--destino', default='relatorios')
+    exportar.add_argument('--processos', type=int, default=None)
+
+    # Animação do mapa por fotogramas
+    animar = comandos.add_parser('animar', help='exportar a animação do mapa como GIF ou sequência de imagens')
+    animar.add_argument('--anos', nargs='*', type=int, default=[])
+    animar.add_argument('--formato', choices=['gif', 'png'], default='gif')
+    animar.add_argument('--destino', default='relatorios')
+    animar.add_argument('--processos', type=int, default=None)
+    animar.add_argument('--largura', type=int, default=ESTILO_MAPA['largura'])
+    animar.add_argument('--altura', type=int, default=ESTILO_MAPA['altura'])
+    animar.add_argument('--escala', type=float, default=ESTILO_MAPA['escala'])
+    animar.add_argument('--duracao', type=int, default=ESTILO_MAPA['duracao_ms'], help='duração de cada fotograma (ms)')
+
+    # Validação dos dados atuais (relatório da última limpeza ou, se não corresponder aos dados, dos CSV limpos)
+    comandos.add_parser('validar', help='limpar os dados, se mudaram, e apresentar o relatório de validação dos dados atuais')
+
+    # Memória das tabelas lidas dos CSV, no modo compacto e do que fica retido depois do carregamento
+    comandos.add_parser('memoria', help='comparar a memória das tabelas lidas dos CSV, no modo compacto e retidas')
+
+    # Serviço HTTP/JSON
+    servico = comandos.add_parser('servir', help='servir as tabelas e séries em JSON por HTTP')
+    servico.add_argument('--anfitriao', default='127.0.0.1')
+    servico.add_argument('--porta', type=int, default=8000)
+    servico.add_argument('--capacidade', type=int, default=CAPACIDADE_CACHE_RESPOSTAS)
+    servico.add_argument('--validade', type=float, default=VALIDADE_CACHE_RESPOSTAS)
+
+    # Instrumentação (antes do comando, ex.: python Projeto.py --medir exportar)
+    parser.add_argument('--medir', action='store_true', help='apresentar o resumo das medições de cada etapa no fim')
+    parser.add_argument('--registo', default=REGISTO_MEDICOES, help='ficheiro JSON lines onde é escrita cada medição')
+    parser.add_argument('--perfil', default=PERFIL, help='executar sob o cProfile e o tracemalloc, guardando o perfil neste ficheiro')
+
+    return parser.parse_args()
+
+
+# %%
+if __name__ == '__main__':
+    args = argumentos()
+    REGISTO_MEDICOES = args.registo
+
+    # Os comandos da linha de comandos correm sem o utilizador: um erro de validação dos dados interrompe-os
+    VALIDACAO_ESTRITA = args.comando is not None
+
+    with perfil(args.perfil) if args.perfil else nullcontext():
+        try:
+            if args.comando == 'validar':
+                relatorio = relatorio_validacao()
+                print(f"Dados validados: {relatorio['fonte']}")
+                imprimir_relatorio_validacao(relatorio['violacoes'])
+                if tem_erros(relatorio['violacoes']):
+                    raise SystemExit(1)
+            elif args.comando == 'exportar':
+                imprimir_relatorio_exportacao(exportar_graficos(args.graficos, args.anos, args.paises, args.formatos,
+                                                                args.destino, args.processos))
+            elif args.comando == 'animar':
+                estilo = {'largura': args.largura, 'altura': args.altura, 'escala': args.escala, 'duracao_ms': args.duracao}
+                imprimir_relatorio_animacao(animar_mapa(args.anos, args.formato, args.destino, estilo, args.processos))
+            elif args.comando == 'memoria':
+                imprimir_relatorio_memoria(relatorio_memoria())
+            elif args.comando == 'servir':
+                cache_respostas = CacheLRU(args.capacidade, args.validade)
+                servir(args.anfitriao, args.porta)
+            else:
+                # Inicia a execução do programa chamando a função main()
+                main()
+        except ErroValidacao as erro:
+            # Modo estrito: apresentar as violações e terminar com erro, sem usar os dados
+            imprimir_relatorio_validacao(erro.violacoes)
+            raise SystemExit(1)
+        except (RuntimeError, ValueError) as erro:
+            # Verificações feitas pelos comandos antes de começarem (ex.: kaleido em falta ou um país desconhecido em
+            # --paises): apresentar a mensagem e terminar com erro, sem traceback; no menu, o erro não é intercetado
+            if args.comando is None:
+                raise
+            print(f'Erro: {erro}', file=sys.stderr)
+            raise SystemExit(1)
+
+    if args.medir:
+        imprimir_medicoes()
+    registar({'tipo': 'resumo', 'etapas': medicoes, 'contadores': contadores})
 
 
 # %% [markdown]
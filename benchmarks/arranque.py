@@ -0,0 +1,64 @@
+# Mede o tempo de arranque do Projeto.py: tempo de importação dos módulos e tempo até o menu aparecer.
+# Executar a partir da raiz do repositório: python benchmarks/arranque.py [--repeticoes N]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT = b'Op\xc3\xa7\xc3\xa3o:'
+
+
+def tempos_importacao(top=10):
+    # 'python -X importtime' escreve no stderr uma linha por módulo: "import time: self [us] | cumulative | imported package"
+    saida = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import Projeto'],
+                           cwd=RAIZ, capture_output=True, text=True).stderr
+    modulos = []
+    for linha in saida.splitlines():
+        if not linha.startswith('import time:') or 'cumulative' in linha:
+            continue
+        proprio, cumulativo, nome = linha[len('import time:'):].split('|')
+        # A indentação do nome indica o nível de importação (dois espaços por nível)
+        nivel = (len(nome) - len(nome.lstrip()) - 1) // 2
+        modulos.append((int(cumulativo), int(proprio), nivel, nome.strip()))
+    # Só interessam o próprio Projeto e os módulos que ele importa diretamente
+    topo = sorted((m for m in modulos if m[2] <= 1), reverse=True)
+    return topo[:top]
+
+
+def tempo_ate_menu():
+    # Arranca o programa e espera pelo pedido de opção do menu; depois responde '3' para sair
+    inicio = time.perf_counter()
+    processo = subprocess.Popen([sys.executable, 'Projeto.py'], cwd=RAIZ, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    lido = b''
+    while PROMPT not in lido:
+        bloco = processo.stdout.read1(4096)
+        if not bloco:
+            break
+        lido += bloco
+    decorrido = time.perf_counter() - inicio
+    processo.communicate(b'3\n')
+    if PROMPT not in lido:
+        raise RuntimeError('O menu não apareceu')
+    return decorrido
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo de arranque do Projeto.py')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    print('Importações mais lentas (cumulativo, ms):')
+    for cumulativo, proprio, nivel, nome in tempos_importacao():
+        print(f'  {cumulativo / 1000:9.1f}  {nome}')
+
+    tempos = [tempo_ate_menu() for _ in range(args.repeticoes)]
+    print(f'Tempo até ao menu: mediana {statistics.median(tempos) * 1000:.0f} ms '
+          f'(mín {min(tempos) * 1000:.0f} ms, máx {max(tempos) * 1000:.0f} ms, {args.repeticoes} repetições)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# Teste de carga do serviço HTTP/JSON (python Projeto.py servir): vários clientes concorrentes, cada um com uma
+# ligação persistente, repetem pedidos a uma mistura de caminhos; no fim são apresentados o débito e as latências.
+# Executar a partir da raiz do repositório: python benchmarks/carga.py [--clientes 16] [--pedidos 5000]
+# Sem --url, o serviço é arrancado num subprocesso numa porta livre e terminado no fim.
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAISES = ['Portugal', 'Spain', 'France', 'Germany', 'United Kingdom', 'United States', 'Brazil', 'India', 'China', 'Japan']
+ANOS = range(1990, 2018)
+TABELAS = ['df_0', 'df_1', 'df_2', 'df_3']
+
+
+def caminhos():
+    # Mistura de pedidos às quatro vistas do serviço
+    lista = []
+    for pais in PAISES:
+        lista += [f'/tabela?nome={nome}&pais={quote(pais)}' for nome in TABELAS]
+        lista += [f'/describe?nome={nome}&pais={quote(pais)}' for nome in TABELAS]
+        lista.append(f'/series?pais={quote(pais)}')
+    lista += [f'/top?ano={ano}&n=20' for ano in ANOS]
+    return lista
+
+
+async def cliente(anfitriao, porta, alvos, latencias, estados):
+    leitor, escritor = await asyncio.open_connection(anfitriao, porta)
+    for alvo in alvos:
+        inicio = time.perf_counter()
+        escritor.write(f'GET {alvo} HTTP/1.1\r\nHost: {anfitriao}\r\n\r\n'.encode())
+        await escritor.drain()
+
+        # Linha de estado, cabeçalhos e corpo com o tamanho indicado em Content-Length
+        estado = int((await leitor.readline()).split()[1])
+        tamanho = 0
+        while (cabecalho := await leitor.readline()).strip():
+            nome, _, valor = cabecalho.decode('latin-1').partition(':')
+            if nome.lower() == 'content-length':
+                tamanho = int(valor)
+        await leitor.readexactly(tamanho)
+
+        latencias.append(time.perf_counter() - inicio)
+        estados[estado] = estados.get(estado, 0) + 1
+    escritor.close()
+
+
+async def carga(anfitriao, porta, clientes, pedidos, semente):
+    # Cada cliente recebe a sua parte dos pedidos, escolhidos ao acaso da mistura
+    aleatorio = random.Random(semente)
+    lista = caminhos()
+    alvos = [aleatorio.choices(lista, k=pedidos // clientes + (i < pedidos % clientes)) for i in range(clientes)]
+
+    latencias, estados = [], {}
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente(anfitriao, porta, a, latencias, estados) for a in alvos))
+    duracao = time.perf_counter() - inicio
+
+    latencias = np.array(latencias) * 1000
+    return {
+        'clientes': clientes,
+        'pedidos': len(latencias),
+        'estados': estados,
+        'duracao_s': round(duracao, 3),
+        'pedidos_por_s': round(len(latencias) / duracao, 1),
+        'latencia_ms': {p: round(float(np.percentile(latencias, int(p[1:]))), 2) for p in ('p50', 'p90', 'p99')}
+                       | {'max': round(float(latencias.max()), 2)},
+    }
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servico(porta, validade):
+    # Arranca o serviço e espera até aceitar ligações
+    processo = subprocess.Popen([sys.executable, 'Projeto.py', 'servir', '--porta', str(porta), '--validade', str(validade)],
+                                cwd=RAIZ, stdout=subprocess.DEVNULL)
+    while True:
+        if processo.poll() is not None:
+            raise RuntimeError('O serviço terminou antes de aceitar ligações')
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=0.1).close()
+            return processo
+        except OSError:
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do serviço HTTP/JSON')
+    parser.add_argument('--url', help='endereço de um serviço já em execução, ex.: http://127.0.0.1:8000')
+    parser.add_argument('--clientes', type=int, default=16)
+    parser.add_argument('--pedidos', type=int, default=5000)
+    parser.add_argument('--validade', type=float, default=300,
+                        help='validade da cache de respostas do serviço arrancado (0 para medir sem cache)')
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='imprimir o resultado em JSON')
+    args = parser.parse_args()
+
+    processo = None
+    if args.url:
+        url = urlsplit(args.url)
+        anfitriao, porta = url.hostname, url.port
+    else:
+        anfitriao, porta = '127.0.0.1', porta_livre()
+        processo = arrancar_servico(porta, args.validade)
+
+    try:
+        resultado = asyncio.run(carga(anfitriao, porta, args.clientes, args.pedidos, args.semente))
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    if args.json:
+        print(json.dumps(resultado))
+    else:
+        latencia = resultado['latencia_ms']
+        print(f"{resultado['pedidos']} pedidos de {resultado['clientes']} clientes em {resultado['duracao_s']:.2f} s: "
+              f"{resultado['pedidos_por_s']:.0f} pedidos/s")
+        print(f"Latência (ms): p50 {latencia['p50']}, p90 {latencia['p90']}, p99 {latencia['p99']}, máx. {latencia['max']}")
+        print(f"Estados HTTP: {resultado['estados']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Gerador de ficheiros em bruto sintéticos com o mesmo formato de 'Mental_health_Depression_disorder_Data.csv':
+# quatro sub-tabelas empilhadas num único CSV, cada uma iniciada por uma linha de cabeçalho repetida (coluna 'Year'
+# igual a 'Year'), com países (códigos ISO), agregados sem código e entidades com códigos não ISO.
+# Executar a partir da raiz do repositório: python benchmarks/dados_sinteticos.py destino.csv [--escala 10]
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ISO_PATH = os.path.join(RAIZ, 'data/raw_data/iso_countries.csv')
+
+# Largura do ficheiro: a coluna de índice, as chaves e as métricas da primeira sub-tabela
+LARGURA = 11
+
+# Métricas de cada sub-tabela (com o intervalo de valores gerados), anos das linhas e anos com valores das métricas;
+# fora destes anos só a população é preenchida, como no ficheiro original
+SUBTABELAS = [
+    ({'Schizophrenia (%)': (0.15, 0.4), 'Bipolar disorder (%)': (0.3, 1.2), 'Eating disorders (%)': (0.05, 1.0),
+      'Anxiety disorders (%)': (2.0, 9.0), 'Drug use disorders (%)': (0.3, 3.5), 'Depression (%)': (2.0, 6.5),
+      'Alcohol use disorders (%)': (0.4, 5.0)}, (1990, 2017), (1990, 2017)),
+    ({'Prevalence in males (%)': (1.5, 5.0), 'Prevalence in females (%)': (2.5, 8.0),
+      'Population': (1e4, 1.4e9)}, (1800, 2019), (1990, 2017)),
+    ({'Suicide rate (deaths per 100,000 individuals)': (2.0, 50.0),
+      'Depressive disorder rates (number suffering per 100,000)': (2000.0, 6000.0),
+      'Population': (1e4, 1.4e9)}, (1800, 2019), (1990, 2017)),
+    ({'Prevalence - Depressive disorders - Sex: Both - Age: All Ages (Number) (people suffering from depression)':
+      (1e3, 5e7)}, (1990, 2017), (1990, 2017)),
+]
+
+# Agregados do GBD (sem código) e entidades com códigos que não são ISO
+AGREGADOS = ['World', 'High SDI', 'Low SDI', 'Middle SDI', 'Western Europe', 'Eastern Europe', 'Central Asia',
+             'South Asia', 'North America', 'Sub-Saharan Africa', 'Latin America and Caribbean', 'England', 'Scotland']
+CODIGOS_NAO_ISO = [('Kosovo', 'OWID_KOS'), ('Micronesia (region)', 'OWID_MIC')]
+
+# Fração de valores em falta nas métricas
+FRACAO_NULOS = 0.01
+
+
+def entidades_base():
+    # Países do ficheiro ISO, agregados sem código e entidades com códigos não ISO
+    iso = pd.read_csv(ISO_PATH, keep_default_na=False)
+    nomes = list(iso['name']) + AGREGADOS + [nome for nome, _ in CODIGOS_NAO_ISO]
+    codigos = list(iso['alpha-3']) + [''] * len(AGREGADOS) + [codigo for _, codigo in CODIGOS_NAO_ISO]
+    return nomes, codigos
+
+
+def entidades(escala):
+    # A escala multiplica o número de entidades: cada cópia tem um nome diferente e o mesmo código
+    nomes, codigos = entidades_base()
+    todos_nomes, todos_codigos = [], []
+    for copia in range(escala):
+        todos_nomes += nomes if copia == 0 else [f'{nome} ({copia + 1})' for nome in nomes]
+        todos_codigos += codigos
+    return todos_nomes, todos_codigos
+
+
+def gerar_subtabela(metricas, anos, anos_valores, nomes, codigos, aleatorio, aleatorio_populacao):
+    # Uma linha por entidade e ano, com valores aleatórios em cada métrica; a população vem de um gerador próprio, para
+    # que seja a mesma em todas as sub-tabelas (como no ficheiro original, em que a validação do Projeto a compara)
+    lista_anos = np.arange(anos[0], anos[1] + 1)
+    n = len(nomes) * len(lista_anos)
+    ano = np.tile(lista_anos, len(nomes))
+    colunas = {
+        'Entity': np.repeat(np.array(nomes, dtype=object), len(lista_anos)),
+        'Code': np.repeat(np.array(codigos, dtype=object), len(lista_anos)),
+        'Year': ano,
+    }
+    com_valores = (ano >= anos_valores[0]) & (ano <= anos_valores[1])
+    for metrica, (minimo, maximo) in metricas.items():
+        if metrica == 'Population':
+            valores = np.round(aleatorio_populacao.uniform(minimo, maximo, n))
+        else:
+            valores = np.round(aleatorio.uniform(minimo, maximo, n), 6)
+            valores[~com_valores | (aleatorio.random(n) < FRACAO_NULOS)] = np.nan
+        colunas[metrica] = valores
+    return pd.DataFrame(colunas)
+
+
+def gerar_bruto(destino, escala=1, semente=0, entidades_por_parte=2000):
+    # Escreve o ficheiro por partes (grupos de entidades) para não ter todo o ficheiro em memória; devolve o número de linhas
+    aleatorio = np.random.default_rng(semente)
+    nomes, codigos = entidades(escala)
+    colunas_ficheiro = ['index', 'Entity', 'Code', 'Year'] + list(SUBTABELAS[0][0])
+
+    linhas = 0
+    with open(destino, 'w', newline='') as f:
+        pd.DataFrame(columns=colunas_ficheiro).to_csv(f, index=False)
+        for t, (metricas, anos, anos_valores) in enumerate(SUBTABELAS):
+            # Linha de cabeçalho repetida que inicia cada sub-tabela depois da primeira
+            if t > 0:
+                cabecalho = ['Entity', 'Code', 'Year'] + list(metricas)
+                f.write(','.join([str(linhas)] + [f'"{c}"' if ',' in c else c for c in cabecalho]
+                                 + [''] * (LARGURA - 1 - len(cabecalho))) + '\n')
+                linhas += 1
+
+            for inicio in range(0, len(nomes), entidades_por_parte):
+                parte = gerar_subtabela(metricas, anos, anos_valores, nomes[inicio:inicio + entidades_por_parte],
+                                        codigos[inicio:inicio + entidades_por_parte], aleatorio,
+                                        np.random.default_rng([semente, inicio]))
+                parte.columns = colunas_ficheiro[1:len(parte.columns) + 1]
+                parte = parte.reindex(columns=colunas_ficheiro[1:])
+                parte.insert(0, 'index', np.arange(linhas, linhas + len(parte)))
+                parte.to_csv(f, header=False, index=False)
+                linhas += len(parte)
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gerar um ficheiro em bruto sintético')
+    parser.add_argument('destino')
+    parser.add_argument('--escala', type=int, default=1)
+    parser.add_argument('--semente', type=int, default=0)
+    args = parser.parse_args()
+    print(f'{gerar_bruto(args.destino, args.escala, args.semente)} linhas escritas em {args.destino}')
+
+
+if __name__ == '__main__':
+    main()
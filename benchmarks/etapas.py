@@ -0,0 +1,159 @@
+# Mede o tempo de cada etapa do Projeto.py sobre ficheiros em bruto sintéticos de várias escalas: leitura, divisão em
+# sub-tabelas, limpeza, validação, escrita dos CSV limpos, carregamento (cache e armazenamento normalizado), consulta
+# por país e construção de cada gráfico. O resultado é uma linha JSON por escala (com o número de linhas em violação
+# da validação nos contadores), para comparar entre commits.
+# Executar a partir da raiz do repositório: python benchmarks/etapas.py [--escalas 1 10 100 1000] [--saida resultados.jsonl]
+# (a escala 1000 gera um ficheiro de vários GB)
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+from dados_sinteticos import ISO_PATH, gerar_bruto
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Número de países consultados na etapa de consulta
+PAISES_CONSULTA = 50
+
+# Etapas medidas pelo Projeto (função 'medir') durante o tratamento e o carregamento dos dados
+ETAPAS = ['leitura', 'divisao', 'limpeza', 'validacao', 'escrita', 'hash', 'cache', 'carga']
+
+
+def commit_atual():
+    resultado = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True)
+    return resultado.stdout.strip() or None
+
+
+def importar_projeto():
+    # Os gráficos são construídos sem janela
+    matplotlib.use('Agg')
+    sys.path.insert(0, RAIZ)
+    import Projeto
+    return Projeto
+
+
+def reiniciar(P):
+    # Descartar os dados e as caches em memória do Projeto, para que cada escala comece do zero
+    P.armazem = P.df_iso = P.resumos = P.cubo = P.matriz_series = P.analise = P.resolvedor = None
+    P.figuras.limpar()
+    P.cache_series.limpar()
+    P.modelos.clear()
+    P.classificacoes.clear()
+
+
+def medir_pipeline(P):
+    # Tempo de cada etapa do tratamento dos dados (sem cache) e do carregamento, a partir das medições do próprio Projeto
+    P.reiniciar_medicoes()
+    P.obter_armazem()
+    return {etapa: P.medicoes[etapa]['duracao_s'] for etapa in ETAPAS if etapa in P.medicoes}
+
+
+def medir_consultas(P):
+    armazem = P.obter_armazem()
+    paises = armazem['entidades'].loc[~armazem['entidades']['agregado'], 'Entity'].to_numpy()
+    paises = np.random.default_rng(0).choice(paises, min(PAISES_CONSULTA, len(paises)), replace=False)
+
+    # Tempo médio de uma consulta por país a cada tabela limpa, como em 'tabela'
+    inicio = time.perf_counter()
+    for pais in paises:
+        for nome in armazem['metricas_tabela']:
+            P.dados_tabela(nome, pais)
+    tempos = {'consulta_pais': (time.perf_counter() - inicio) / (len(paises) * len(armazem['metricas_tabela']))}
+
+    # Consultas a agregados e a uma entidade desconhecida, que em várias tabelas não têm linhas (devolvem uma tabela
+    # vazia com as colunas da tabela)
+    outras = list(armazem['entidades'].loc[armazem['entidades']['agregado'], 'Entity']) + ['Entidade desconhecida']
+    inicio = time.perf_counter()
+    for entidade in outras:
+        for nome, metricas in armazem['metricas_tabela'].items():
+            if list(P.dados_tabela(nome, entidade).columns[3:-1]) != metricas:
+                raise RuntimeError(f'Colunas inesperadas na consulta a {entidade} em {nome}')
+    tempos['consulta_agregado'] = (time.perf_counter() - inicio) / (len(outras) * len(armazem['metricas_tabela']))
+    return tempos
+
+
+def medir_graficos(P):
+    # Construção de cada gráfico sem cache (incluindo a figura modelo), para um ano e um país
+    tempos = {}
+    parametros = {'mapa': 2017, 'bolhas': 2017, 'bolhas_regioes': 2017, 'barras': 2017, 'linhas': 'Portugal'}
+    for tipo, (figura, _) in P.GRAFICOS.items():
+        inicio = time.perf_counter()
+        fig = figura(parametros[tipo])
+        tempos[f'figura_{tipo}'] = time.perf_counter() - inicio
+        if hasattr(fig, 'savefig'):
+            matplotlib.pyplot.close(fig)
+    return tempos
+
+
+def medir_escala(P, escala, pasta):
+    # Preparar uma pasta de trabalho com a estrutura de pastas do projeto e o ficheiro em bruto sintético, sem a cache
+    # nem os CSV limpos de uma execução anterior
+    for pasta_anterior in ('data/cache', 'data/clean_data'):
+        shutil.rmtree(os.path.join(pasta, pasta_anterior), ignore_errors=True)
+    os.makedirs(os.path.join(pasta, 'data/raw_data'), exist_ok=True)
+    os.makedirs(os.path.join(pasta, 'data/clean_data'), exist_ok=True)
+    shutil.copy(ISO_PATH, os.path.join(pasta, 'data/raw_data'))
+    inicio = time.perf_counter()
+    linhas = gerar_bruto(os.path.join(pasta, P.RAW_PATH), escala)
+    geracao = time.perf_counter() - inicio
+
+    # Os caminhos do Projeto são relativos à pasta atual
+    anterior = os.getcwd()
+    os.chdir(pasta)
+    try:
+        reiniciar(P)
+        etapas = medir_pipeline(P)
+        etapas.update(medir_consultas(P))
+        etapas.update(medir_graficos(P))
+        contadores = dict(P.contadores)
+    finally:
+        os.chdir(anterior)
+
+    return {
+        'commit': commit_atual(),
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'escala': escala,
+        'linhas': linhas,
+        'bytes': os.path.getsize(os.path.join(pasta, P.RAW_PATH)),
+        'geracao_s': round(geracao, 4),
+        'etapas_s': {etapa: round(tempo, 4) for etapa, tempo in etapas.items()},
+        'contadores': contadores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo de cada etapa do Projeto.py em dados sintéticos')
+    parser.add_argument('--escalas', nargs='+', type=int, default=[1, 10])
+    parser.add_argument('--saida', help='ficheiro JSON lines ao qual são acrescentados os resultados')
+    parser.add_argument('--pasta', help='pasta de trabalho (por omissão, uma pasta temporária apagada no fim)')
+    args = parser.parse_args()
+
+    P = importar_projeto()
+    for escala in args.escalas:
+        if args.pasta:
+            resultado = medir_escala(P, escala, os.path.join(args.pasta, f'escala_{escala}'))
+        else:
+            with tempfile.TemporaryDirectory() as pasta:
+                resultado = medir_escala(P, escala, pasta)
+
+        linha = json.dumps(resultado, ensure_ascii=False)
+        print(linha, flush=True)
+        if args.saida:
+            with open(args.saida, 'a') as f:
+                f.write(linha + '\n')
+
+
+if __name__ == '__main__':
+    main()